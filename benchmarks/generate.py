@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import argparse
+
+FORMATS = ('env', 'json', 'py')
+
+PY_TEMPLATE = '''TOOLS = %s
+
+
+def get_tools():
+    return TOOLS
+'''
+
+
+def tool_name(index):
+    return 'tool%03i' % index
+
+
+def make_tool(index, versions, chain):
+    name = tool_name(index)
+    prefix = name.upper()
+
+    environment = {
+        prefix + '_VERSION': '%(version)s',
+        prefix + '_ROOT': '/software/%(tool)s/${' + prefix + '_VERSION}',
+    }
+
+    previous = prefix + '_ROOT'
+    for link in range(chain):
+        key = '%s_LINK%i' % (prefix, link)
+        environment[key] = '${%s}/link%i' % (previous, link)
+        previous = key
+
+    environment['PATH'] = '${%s}/bin' % previous
+    environment['PYTHONPATH'] = {
+        '*': '${%s}/python' % previous,
+        'mode': 'prepend'
+    }
+
+    return {
+        'tool': name,
+        'version': ['%i.%i.0' % (1 + x // 10, x % 10) for x in range(versions)],
+        'platforms': ['windows', 'linux', 'darwin'],
+        'requires': [],
+        'environment': environment,
+    }
+
+
+def write_tool(directory, tool, fmt):
+    path = os.path.join(directory, '%s.%s' % (tool['tool'], fmt))
+    with open(path, 'w') as f:
+        if fmt == 'py':
+            f.write(PY_TEMPLATE % repr([tool]))
+        else:
+            json.dump(tool, f, indent=4)
+    return path
+
+
+def make_presets(tools, presets, depth, tools_per_preset=3):
+    result = []
+    for chain in range(presets):
+        previous = None
+        for level in range(depth):
+            first = (chain * depth + level) * tools_per_preset
+            names = [
+                '%s%s' % (tool_name(x % len(tools)),
+                          tools[x % len(tools)]['version'][-1])
+                for x in range(first, first + tools_per_preset)
+            ]
+            if previous:
+                names.insert(0, 'preset:' + previous)
+
+            name = 'preset%03i_%i' % (chain, level)
+            result.append({
+                'name': name,
+                'tools': names,
+                'default_command': 'echo',
+            })
+            previous = name
+
+    return result
+
+
+def generate_repository(root, tools=100, versions=5, presets=10, depth=3,
+                        chain=3, formats=FORMATS):
+    env_dir = os.path.join(root, 'envs')
+    preset_dir = os.path.join(root, 'presets')
+    for directory in (env_dir, preset_dir):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    tool_data = [make_tool(x, versions, chain) for x in range(tools)]
+    for index, tool in enumerate(tool_data):
+        write_tool(env_dir, tool, formats[index % len(formats)])
+
+    preset_data = make_presets(tool_data, presets, depth)
+    for preset in preset_data:
+        path = os.path.join(preset_dir, preset['name'] + '.json')
+        with open(path, 'w') as f:
+            json.dump(preset, f, indent=4)
+
+    # Files modified within the last seconds are always read again by the
+    # discovery cache and the registry: date them back like deployed ones.
+    mtime = time.time() - 3600
+    for directory in (env_dir, preset_dir):
+        for name in os.listdir(directory):
+            os.utime(os.path.join(directory, name), (mtime, mtime))
+
+    return {
+        'env': env_dir,
+        'preset': preset_dir,
+        'tools': ['%s%s' % (x['tool'], x['version'][-1]) for x in tool_data],
+        'presets': [x['name'] for x in preset_data],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic ecosystem repository.')
+    parser.add_argument('root')
+    parser.add_argument('--tools', type=int, default=100)
+    parser.add_argument('--versions', type=int, default=5)
+    parser.add_argument('--presets', type=int, default=10)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--chain', type=int, default=3)
+    parser.add_argument('--formats', nargs='+', default=list(FORMATS),
+                        choices=FORMATS)
+    args = parser.parse_args()
+
+    info = generate_repository(
+        args.root, tools=args.tools, versions=args.versions,
+        presets=args.presets, depth=args.depth, chain=args.chain,
+        formats=args.formats)
+    print('ECO_ENV=%s' % info['env'])
+    print('ECO_PRESET_PATH=%s' % info['preset'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(os.path.dirname(HERE), 'source')
+sys.path.insert(0, SOURCE)
+sys.path.insert(0, HERE)
+
+import ecosystem  # noqa: E402
+import generate  # noqa: E402
+from run import new_ecosystem, default_tmpdir  # noqa: E402
+
+
+def measure(function):
+    '''Run ``function`` and return the memory still allocated by what it
+    returned, and its peak.'''
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, {'current': current, 'peak': peak, 'time': elapsed}
+
+
+def run_benchmarks(args):
+    root = tempfile.mkdtemp(prefix='ecosystem-memory.', dir=args.tmpdir)
+    try:
+        repository = generate.generate_repository(
+            root, tools=args.tools, versions=args.versions,
+            presets=args.presets, depth=args.depth, chain=args.chain)
+
+        def discover():
+            eco = new_ecosystem(repository, lazy=True)
+            eco.discover()
+            return eco
+
+        eco, discovered = measure(discover)
+        names = eco.list_tools()
+
+        def build():
+            return [eco.get_tool(x) for x in names]
+
+        tools, built = measure(build)
+        variables = sum(len(x.envs) for x in tools)
+
+        results = []
+        for name, result, count in (
+                ('discover', discovered, len(names)),
+                ('build_tools', built, variables)):
+            result.update({
+                'scenario': name,
+                'count': count,
+                'per_item': result['current'] / float(max(count, 1)),
+            })
+            results.append(result)
+            sys.stderr.write('%-12s %10.1fKB %8.1fB/item peak %10.1fKB\n' % (
+                name, result['current'] / 1024.0, result['per_item'],
+                result['peak'] / 1024.0))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        'ecosystem_version': ecosystem.__version__,
+        'python': platform.python_version(),
+        'platform': platform.system().lower(),
+        'timestamp': time.time(),
+        'parameters': {
+            'tools': args.tools,
+            'versions': args.versions,
+            'presets': args.presets,
+            'depth': args.depth,
+            'chain': args.chain,
+        },
+        'results': results,
+    }
+
+
+def compare(current, previous_path):
+    with open(previous_path, 'r') as f:
+        previous = json.load(f)
+
+    baseline = dict((x['scenario'], x) for x in previous['results'])
+    for result in current['results']:
+        if result['scenario'] not in baseline:
+            continue
+        ratio = result['current'] / float(
+            max(baseline[result['scenario']]['current'], 1))
+        sys.stderr.write('%-12s %6.2fx memory vs %s\n' % (
+            result['scenario'], ratio, previous['ecosystem_version']))
+
+
+def main():
+    logging.getLogger('ecosystem').setLevel(logging.ERROR)
+
+    parser = argparse.ArgumentParser(
+        description='Measure the memory held by discovered and built tools.')
+    parser.add_argument('--tools', type=int, default=1000)
+    parser.add_argument('--versions', type=int, default=10)
+    parser.add_argument('--presets', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--chain', type=int, default=3)
+    parser.add_argument('--tmpdir', default=default_tmpdir())
+    parser.add_argument('--output', help='write the JSON results here')
+    parser.add_argument('--compare', help='previous JSON results')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+
+    if args.compare:
+        compare(results, args.compare)
+
+    data = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data)
+    else:
+        sys.stdout.write(data + '\n')
+
+
+if __name__ == '__main__':
+    main()
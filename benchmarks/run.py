@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import logging
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(os.path.dirname(HERE), 'source')
+sys.path.insert(0, SOURCE)
+sys.path.insert(0, HERE)
+
+import ecosystem  # noqa: E402
+import generate  # noqa: E402
+import slowfs  # noqa: E402
+
+
+@contextlib.contextmanager
+def null_context():
+    yield
+
+
+def measure(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        timings.append(time.time() - start)
+
+    timings.sort()
+    return {
+        'runs': repeat,
+        'min': timings[0],
+        'median': timings[len(timings) // 2],
+        'mean': sum(timings) / len(timings),
+    }
+
+
+def new_ecosystem(repository, **kwargs):
+    return ecosystem.Ecosystem(
+        env_search_paths=[repository['env']],
+        preset_search_paths=[repository['preset']],
+        plugin_searach_paths=[''],
+        snapshot_store=kwargs.pop('snapshot_store', None),
+        **kwargs
+    )
+
+
+def scenario_discover(repository, args):
+    def run():
+        eco = new_ecosystem(repository, lazy=True)
+        eco.discover()
+    return run
+
+
+def scenario_discover_parallel(repository, args):
+    def run():
+        eco = new_ecosystem(repository, lazy=True,
+                            discover_workers=args.workers)
+        eco.discover()
+    return run
+
+
+def scenario_discover_bundle(repository, args):
+    path = os.path.join(os.path.dirname(repository['env']), 'eco.bundle')
+    problems = new_ecosystem(repository, lazy=True).compile(path)
+    if problems:
+        raise RuntimeError('Could not compile: %s' % problems[0])
+
+    def run():
+        eco = new_ecosystem(repository, lazy=True, bundle_path=path)
+        eco.list_tools()
+        eco.list_presets()
+    return run
+
+
+def scenario_discover_registry(repository, args):
+    path = os.path.join(os.path.dirname(repository['env']), 'registry.db')
+    new_ecosystem(repository, lazy=True, registry_path=path).discover()
+    tools = repository['tools'][:args.resolve_tools]
+
+    def run():
+        eco = new_ecosystem(repository, lazy=True, registry_path=path)
+        for tool in tools:
+            eco.get_tool(tool)
+    return run
+
+
+def scenario_discover_manifest(repository, args):
+    # A copy, so the other scenarios keep listing directories.
+    root = os.path.join(os.path.dirname(repository['env']), 'manifest')
+    copy = dict(repository)
+    for part in ('env', 'preset'):
+        copy[part] = os.path.join(root, part)
+        if not os.path.isdir(copy[part]):
+            shutil.copytree(repository[part], copy[part])
+    new_ecosystem(copy, lazy=True).write_manifests()
+
+    def run():
+        eco = new_ecosystem(copy, lazy=True)
+        eco.discover()
+    return run
+
+
+def scenario_expand_presets(repository, args):
+    eco = new_ecosystem(repository, lazy=True)
+
+    def run():
+        manager = eco.presetmanager
+        manager.discover()
+        for name in manager.list_presets():
+            manager.get_preset(name).tools
+    return run
+
+
+def scenario_resolve(repository, args):
+    eco = new_ecosystem(repository)
+    known = set(eco.list_tools())
+    tools = [x for x in repository['tools'] if x in known]
+    tools = tools[:args.resolve_tools]
+    base = {'PATH': '/usr/bin:/bin'}
+
+    def run():
+        environment = eco.get_environment(*tools)
+        environment.resolve_environ(base=base, store_previous=False)
+    return run
+
+
+def scenario_resolve_many(repository, args):
+    eco = new_ecosystem(repository)
+    known = set(eco.list_tools())
+    tools = [x for x in repository['tools'] if x in known]
+    requests = [tools[x:x + args.resolve_tools]
+                for x in range(0, len(tools), 2)]
+    base = {'PATH': '/usr/bin:/bin'}
+
+    def run():
+        eco.resolve_many(requests, base=base)
+    return run
+
+
+def scenario_cli_startup(repository, args):
+    env = dict(os.environ)
+    env.update({
+        'ECO_ENV': repository['env'],
+        'ECO_PRESET_PATH': repository['preset'],
+        'ECO_PLUGIN_PATH': '',
+        'PYTHONPATH': SOURCE,
+    })
+    command = [sys.executable, '-m', 'ecosystem', '--list-presets']
+
+    def run():
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(command, env=env, stdout=devnull)
+    return run
+
+
+SCENARIOS = [
+    ('discover', scenario_discover, True),
+    ('discover_parallel', scenario_discover_parallel, True),
+    ('discover_bundle', scenario_discover_bundle, True),
+    ('discover_registry', scenario_discover_registry, True),
+    ('discover_manifest', scenario_discover_manifest, True),
+    ('expand_presets', scenario_expand_presets, True),
+    ('resolve', scenario_resolve, True),
+    ('resolve_many', scenario_resolve_many, True),
+    # A child process cannot be slowed down by patching this one.
+    ('cli_startup', scenario_cli_startup, False),
+]
+
+
+def run_benchmarks(args):
+    root = tempfile.mkdtemp(prefix='ecosystem-bench.', dir=args.tmpdir)
+    try:
+        repository = generate.generate_repository(
+            root, tools=args.tools, versions=args.versions,
+            presets=args.presets, depth=args.depth, chain=args.chain)
+
+        filesystems = [('local', None)]
+        if args.latency:
+            filesystems.append(('slow', args.latency))
+
+        results = []
+        for fs_name, latency in filesystems:
+            for name, scenario, supports_slow in SCENARIOS:
+                if args.scenarios and name not in args.scenarios:
+                    continue
+                if latency and not supports_slow:
+                    continue
+
+                context = null_context()
+                if latency:
+                    context = slowfs.slow_filesystem(latency, prefix=root)
+
+                with context:
+                    run = scenario(repository, args)
+                    result = measure(run, args.repeat)
+
+                result.update({'scenario': name, 'filesystem': fs_name})
+                results.append(result)
+                sys.stderr.write('%-18s %-6s median %8.2fms\n' % (
+                    name, fs_name, result['median'] * 1000))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        'ecosystem_version': ecosystem.__version__,
+        'python': platform.python_version(),
+        'platform': platform.system().lower(),
+        'timestamp': time.time(),
+        'parameters': {
+            'tools': args.tools,
+            'versions': args.versions,
+            'presets': args.presets,
+            'depth': args.depth,
+            'chain': args.chain,
+            'resolve_tools': args.resolve_tools,
+            'workers': args.workers,
+            'latency': args.latency,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(current, previous_path):
+    with open(previous_path, 'r') as f:
+        previous = json.load(f)
+
+    baseline = dict(
+        ((x['scenario'], x['filesystem']), x) for x in previous['results'])
+    for result in current['results']:
+        key = (result['scenario'], result['filesystem'])
+        if key not in baseline:
+            continue
+        ratio = result['median'] / max(baseline[key]['median'], 1e-9)
+        sys.stderr.write('%-18s %-6s %6.2fx vs %s\n' % (
+            key[0], key[1], ratio, previous['ecosystem_version']))
+
+
+def default_tmpdir():
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def main():
+    logging.getLogger('ecosystem').setLevel(logging.ERROR)
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark discovery, preset expansion and resolve.')
+    parser.add_argument('--tools', type=int, default=200)
+    parser.add_argument('--versions', type=int, default=5)
+    parser.add_argument('--presets', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--chain', type=int, default=3)
+    parser.add_argument('--resolve-tools', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.001,
+                        help='seconds per call on the simulated slow '
+                             'filesystem, 0 to skip it')
+    parser.add_argument('--tmpdir', default=default_tmpdir())
+    parser.add_argument('--scenarios', nargs='+')
+    parser.add_argument('--output', help='write the JSON results here')
+    parser.add_argument('--compare', help='previous JSON results')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+
+    if args.compare:
+        compare(results, args.compare)
+
+    data = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data)
+    else:
+        sys.stdout.write(data + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import os
+import io
+import time
+import contextlib
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+
+@contextlib.contextmanager
+def slow_filesystem(latency=0.002, prefix=None):
+    '''Simulate a high-latency filesystem such as NFS.
+
+    Every metadata call and every file open under ``prefix`` (or anywhere
+    when not given) sleeps for ``latency`` seconds before running.
+    '''
+    def affected(path):
+        if prefix is None:
+            return True
+        try:
+            return os.fspath(path).startswith(prefix)
+        except (AttributeError, TypeError):
+            return str(path).startswith(prefix)
+
+    def wrap(function):
+        def wrapper(path, *args, **kwargs):
+            if affected(path):
+                time.sleep(latency)
+            return function(path, *args, **kwargs)
+        return wrapper
+
+    patches = [
+        (os, 'listdir'), (os, 'stat'), (os.path, 'isfile'),
+        (os.path, 'isdir'), (os.path, 'exists'), (os.path, 'getmtime'),
+        (builtins, 'open'), (io, 'open'),
+    ]
+    if hasattr(os, 'scandir'):
+        patches.append((os, 'scandir'))
+
+    originals = [(module, name, getattr(module, name))
+                 for module, name in patches]
+    try:
+        for module, name, function in originals:
+            setattr(module, name, wrap(function))
+        yield
+    finally:
+        for module, name, function in originals:
+            setattr(module, name, function)
@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from concurrent import futures
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(os.path.dirname(HERE), 'source')
+sys.path.insert(0, SOURCE)
+sys.path.insert(0, HERE)
+
+import ecosystem  # noqa: E402
+import generate  # noqa: E402
+from ecosystem import snapshots  # noqa: E402
+
+DUMP_ENVIRON = 'import json, os, sys; json.dump(dict(os.environ), sys.stdout)'
+
+
+def launch(eco, preset, index, base, expected, store_previous):
+    '''Launch a child dumping its environment and return the mismatches.'''
+    base = dict(base, ECO_STRESS_ID=str(index))
+    process = eco.launch(
+        command=[sys.executable, '-c', DUMP_ENVIRON], presets=[preset],
+        base=base, detached=True, store_previous=store_previous,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    stdout, stderr = process.communicate()
+    if process.returncode:
+        return ['%s #%i exited with %i: %s' % (
+            preset, index, process.returncode, stderr.decode('utf-8'))]
+
+    environ = json.loads(stdout.decode('utf-8'))
+    errors = []
+    if environ.get('ECO_STRESS_ID') != str(index):
+        errors.append('%s #%i got the environment of launch %s' % (
+            preset, index, environ.get('ECO_STRESS_ID')))
+
+    for key, value in expected[preset].items():
+        if environ.get(key) != value:
+            errors.append('%s #%i: %s is %r instead of %r' % (
+                preset, index, key, environ.get(key), value))
+
+    if store_previous:
+        # The snapshot committed for this launch must hold its own base.
+        try:
+            with open(environ['ECO_PREVIOUS_ENV']) as f:
+                previous = json.load(f)
+        except (KeyError, IOError, ValueError) as e:
+            errors.append('%s #%i has no snapshot: %s' % (preset, index, e))
+        else:
+            if previous.get('ECO_STRESS_ID') != str(index):
+                errors.append('%s #%i got the snapshot of launch %s' % (
+                    preset, index, previous.get('ECO_STRESS_ID')))
+    elif 'ECO_PREVIOUS_ENV' in environ:
+        errors.append('%s #%i has a snapshot' % (preset, index))
+
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Launch many presets concurrently from one Ecosystem '
+                    'and check every child gets exactly its environment.')
+    parser.add_argument('--launches', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--tools', type=int, default=50)
+    parser.add_argument('--presets', type=int, default=8)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--watch', action='store_true',
+                        help='rewrite env files while launching')
+    parser.add_argument('--snapshots', choices=['both', 'on', 'off'],
+                        default='both',
+                        help='launch with store_previous on (the default of '
+                             'launch), off, or alternate between both')
+    args = parser.parse_args()
+
+    logging.getLogger('ecosystem').setLevel(logging.ERROR)
+
+    root = tempfile.mkdtemp(prefix='ecosystem-stress-')
+    try:
+        repository = generate.generate_repository(
+            root, tools=args.tools, versions=2, presets=args.presets,
+            depth=args.depth, formats=('json',))
+
+        eco = ecosystem.Ecosystem(
+            env_search_paths=[repository['env']],
+            preset_search_paths=[repository['preset']],
+            plugin_searach_paths=[''],
+            snapshot_store=snapshots.SnapshotStore(
+                root=os.path.join(root, 'snapshots')),
+        )
+        store_previous = {
+            'both': [True, False], 'on': [True], 'off': [False]
+        }[args.snapshots]
+
+        base = dict(os.environ)
+        before = dict(os.environ)
+        presets = repository['presets']
+
+        expected = {}
+        for preset in presets:
+            environ = eco.get_preset_environment(preset).resolve_environ(
+                base=base, store_previous=False)
+            expected[preset] = dict(
+                (x, y) for x, y in environ.items() if base.get(x) != y)
+
+        stop = threading.Event()
+        churn = None
+        if args.watch:
+            # Rewrites files with identical content: the watcher reloads
+            # them while launches are running, results must not change.
+            eco.watch(interval=0.05)
+
+            def rewrite():
+                names = sorted(os.listdir(repository['env']))
+                while not stop.is_set():
+                    for name in names:
+                        path = os.path.join(repository['env'], name)
+                        with open(path) as f:
+                            data = f.read()
+                        with open(path, 'w') as f:
+                            f.write(data)
+                        if stop.wait(0.01):
+                            break
+
+            churn = threading.Thread(target=rewrite)
+            churn.start()
+
+        start = time.time()
+        with futures.ThreadPoolExecutor(max_workers=args.workers) as pool:
+            results = list(pool.map(
+                lambda x: launch(
+                    eco, presets[x % len(presets)], x, base, expected,
+                    store_previous[x % len(store_previous)]),
+                range(args.launches)))
+        elapsed = time.time() - start
+
+        stop.set()
+        if churn:
+            churn.join()
+            eco.stop_watching()
+
+        errors = [x for result in results for x in result]
+        if dict(os.environ) != before:
+            errors.append('os.environ of the launching process was modified')
+
+        for error in errors[:20]:
+            print(error)
+
+        print('%i launches with %i workers in %.2fs (%.1f/s), %i errors' % (
+            args.launches, args.workers, elapsed, args.launches / elapsed,
+            len(errors)))
+        return 1 if errors else 0
+
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,16 @@
-import logging
+import time
+
+# Reference point for the startup time reported by the command line.
+_start_time = time.time()
+
 from .eco import Ecosystem, Environment
 from .errors import MissingDependencyError, MissingRequirementError
 from .errors import ToolNotFoundError, PresetNotFoundError
+from .errors import CyclicDependencyError, UnsatisfiableRequirementsError
 from ._version import __version__, VERSION_MAJOR, VERSION_MINOR, VERSION_PATCH
 
-logging.basicConfig(
-    format='%(levelname)-8s - %(name)-18s:  %(message)s',
-    level=logging.INFO
-)
-
 __all__ = ['Ecosystem', 'Environment', 'MissingDependencyError',
            'MissingRequirementError', 'ToolNotFoundError',
-           'PresetNotFoundError', '__version__', 'VERSION_MAJOR',
-           'VERSION_MINOR', 'VERSION_PATCH']
+           'PresetNotFoundError', 'CyclicDependencyError',
+           'UnsatisfiableRequirementsError', '__version__',
+           'VERSION_MAJOR', 'VERSION_MINOR', 'VERSION_PATCH']
@@ -1,12 +1,13 @@
 import os
 import sys
+import time
 import argparse
 import logging
 import platform
 
-from ecosystem import Ecosystem
-from ecosystem import utils
-from ecosystem import presets
+import ecosystem
+
+# Only the modules each command needs are imported, from within main.
 
 logger = logging.getLogger('ecosystem')
 levels = {
@@ -16,6 +17,108 @@ levels = {
 }
 
 
+def report_startup(budget):
+    elapsed = (time.time() - ecosystem._start_time) * 1000.0
+    if budget and elapsed > budget:
+        logger.warning('Startup took %.1fms, over the %.1fms budget' % (
+            elapsed, budget))
+    else:
+        logger.debug('Startup took %.1fms (budget %.1fms)' % (
+            elapsed, budget))
+
+    return elapsed
+
+
+def run_file(eco, path, jobs=None, log_dir=None, tools=None, presets=None,
+             base=None, shell=False):
+    """Run every command listed in a file, at most ``jobs`` at a time.
+
+    Each line reads like the command line: ``[-t TOOLS | -p PRESETS] [-r
+    COMMAND]``, falling back to the given tools or presets.
+    """
+    import shlex
+    import threading
+    from ecosystem import pool as ecopool
+
+    line_parser = argparse.ArgumentParser(add_help=False)
+    line_group = line_parser.add_mutually_exclusive_group()
+    line_group.add_argument('-t', '--tools', nargs='+')
+    line_group.add_argument('-p', '--preset', nargs='+')
+
+    requests = []
+    with open(path, 'r') as f:
+        for number, line in enumerate(f, 1):
+            tokens = shlex.split(line, comments=True)
+            if not tokens:
+                continue
+
+            command = []
+            for flag in ('-r', '--run'):
+                if flag in tokens:
+                    index = tokens.index(flag)
+                    command = tokens[index + 1:]
+                    tokens = tokens[:index]
+
+            line_parser.prog = '%s:%i' % (path, number)
+            line_args = line_parser.parse_args(tokens)
+            line_tools = line_args.tools
+            line_presets = line_args.preset
+            if not line_tools and not line_presets:
+                line_tools, line_presets = tools, presets
+
+            if line_presets:
+                environment = eco.get_preset_environment(*line_presets)
+                command = command or eco.get_preset(
+                    line_presets[0]).default_command
+                name = line_presets[0]
+            elif line_tools:
+                environment = eco.get_environment(*line_tools)
+                name = '+'.join(line_tools)
+            else:
+                raise ValueError('%s:%i: no tools or preset' % (path, number))
+
+            if not command:
+                raise ValueError('%s:%i: no command' % (path, number))
+
+            requests.append((command, name, environment))
+
+    output_lock = threading.Lock()
+
+    def on_output(job, stream, line):
+        with output_lock:
+            target = sys.stderr if stream == 'stderr' else sys.stdout
+            target.write('[%s] %s\n' % (job.name, line))
+            target.flush()
+
+    def on_exit(job):
+        # Jobs that failed to start are reported by the pool.
+        if job.state == ecopool.CANCELLED:
+            logger.warning('%s: cancelled' % job.name)
+        elif job.state == ecopool.FINISHED:
+            logger.info('%s: exited with %i after %.2fs' % (
+                job.name, job.returncode, job.duration))
+
+    launcher = ecopool.LaunchPool(
+        jobs=jobs, on_output=None if log_dir else on_output, on_exit=on_exit,
+        log_dir=log_dir)
+    with launcher:
+        for command, name, environment in requests:
+            launcher.submit(command, name=name, environment=environment,
+                            base=base, shell=shell)
+
+        try:
+            # Waiting in steps, so that Ctrl+C is handled on Python 2 too.
+            while not all(x.done for x in launcher.wait(timeout=0.5)):
+                pass
+        except KeyboardInterrupt:
+            launcher.cancel()
+            launcher.wait()
+            return 130
+
+    results = launcher.wait()
+    return 0 if all(x.succeeded for x in results) else 1
+
+
 def str2bool(v):
     if v.lower() in ('yes', 'true', 't', 'y', '1'):
         return True
@@ -26,6 +129,10 @@ def str2bool(v):
 
 
 def main(args=sys.argv[1:]):
+    logging.basicConfig(
+        format='%(levelname)-8s - %(name)-18s:  %(message)s',
+        level=logging.INFO
+    )
 
     # Pre-parse
     runcmd = []
@@ -55,6 +162,24 @@ def main(args=sys.argv[1:]):
                          default=platform.system() == 'Windows')
     run_grp.add_argument('--normalize-paths', action='store_true')
     run_grp.add_argument('--from-previous', action='store_true')
+    run_grp.add_argument('-s', '--solve', action='store_true',
+                         help='add the tools required by -t tools, picking '
+                              'versions that satisfy every requirement')
+    run_grp.add_argument('-e', '--export', type=str, default=None,
+                         help='print an activation script for this shell '
+                              'instead of running a command')
+    run_grp.add_argument('--export-path', action='store_true',
+                         help='with --export, print the path of the cached '
+                              'script instead of its contents')
+
+    run_grp.add_argument('--run-file', type=str, default=None,
+                         help='run the commands listed in this file, one '
+                              'per line as "[-t TOOLS | -p PRESETS] -r CMD"')
+    run_grp.add_argument('-j', '--jobs', type=int, default=4,
+                         help='with --run-file, commands run at once')
+    run_grp.add_argument('--log-dir', type=str, default=None,
+                         help='with --run-file, write the output of each '
+                              'command to a rotating log in this directory')
 
     source_subgrp = run_grp.add_mutually_exclusive_group()
     source_subgrp.add_argument('-t', '--tools', nargs='+')
@@ -62,59 +187,163 @@ def main(args=sys.argv[1:]):
 
     common_grp = parser.add_argument_group('common')
     common_grp.add_argument('--verbosity', type=str, default='info')
+    common_grp.add_argument('--cache-path', type=str, default=None)
+    common_grp.add_argument('--gc-snapshots', action='store_true')
+    common_grp.add_argument(
+        '--compile', nargs='?', const='', default=None, metavar='PATH',
+        help='validate every tool and preset and pack them into a bundle '
+             'at PATH (default ECO_BUNDLE)')
+    common_grp.add_argument(
+        '--write-manifests', action='store_true',
+        help='regenerate the manifests listing the files of every search '
+             'path')
+    common_grp.add_argument('--daemon', action='store_true')
+    common_grp.add_argument('--no-daemon', dest='use_daemon',
+                            action='store_false')
+    common_grp.add_argument('--discover-workers', type=int, default=None)
+    common_grp.add_argument('--discover-executor', type=str, default='thread',
+                            choices=['thread', 'process'])
+    common_grp.add_argument(
+        '--trace', type=str, default=os.getenv('ECO_TRACE'),
+        help='write a Chrome trace of discovery and resolve to this file')
+    common_grp.add_argument(
+        '--startup-budget', type=float,
+        default=float(os.getenv('ECO_STARTUP_BUDGET', 200)),
+        help='startup time in milliseconds after which a warning is logged')
 
     args, extra_ = parser.parse_known_args(args)
     extra += extra_
     logger.setLevel(levels.get(args.verbosity, logging.INFO))
 
-    eco = Ecosystem(normalize_paths=args.normalize_paths)
+    if args.trace:
+        from ecosystem import trace
+        trace.enable(args.trace)
+
+    if args.gc_snapshots:
+        from ecosystem import snapshots
+        removed = snapshots.SnapshotStore().gc()
+        sys.stdout.write('Removed %i snapshots\n' % removed)
+        return
+
+    ecosystem_kwargs = dict(
+        normalize_paths=args.normalize_paths,
+        cache_path=args.cache_path,
+        discover_workers=args.discover_workers,
+        discover_executor=args.discover_executor
+    )
+
+    if args.daemon:
+        from ecosystem import daemon
+        daemon.serve(**ecosystem_kwargs)
+        return
+
+    # Lazy, so that listing presets does not parse env files and listing
+    # tools does not load presets.
+    eco = ecosystem.Ecosystem(lazy=True, **ecosystem_kwargs)
+
+    if args.compile is not None:
+        path = args.compile or eco.bundle_path
+        problems = eco.compile(path)
+        if problems:
+            logger.error('Bundle "%s" not written: %i problems' % (
+                path, len(problems)))
+            raise SystemExit(1)
+
+        sys.stdout.write('Compiled "%s"\n' % path)
+        return
+
+    if args.write_manifests:
+        for path in eco.write_manifests():
+            sys.stdout.write('Wrote "%s"\n' % path)
+        return
 
     if args.list:
-        sys.stdout.write('\n'.join(eco.list_tools()))
+        names = eco.list_tools()
+        report_startup(args.startup_budget)
+        sys.stdout.write('\n'.join(names))
         return
 
     if args.list_presets:
-        sys.stdout.write('\n'.join(eco.list_presets()))
+        names = eco.list_presets()
+        report_startup(args.startup_budget)
+        sys.stdout.write('\n'.join(names))
         return
 
+    if args.run_file:
+        from ecosystem import utils
+
+        base = utils.retrieve_environment() if args.from_previous else None
+        code = run_file(eco, args.run_file, jobs=args.jobs,
+                        log_dir=args.log_dir, tools=args.tools,
+                        presets=args.preset, base=base, shell=args.run_shell)
+        raise SystemExit(code)
+
     if runcmd is not None:
         if not args.preset and not args.tools:
             parser.error(
                 'one of te arguments -t/--tools -p/--presets is required')
 
-        if args.preset:
-            if len(args.preset) == 1:
-                preset = eco.get_preset(args.preset[0])
-                environment = preset.get_environment()
+        if args.tools and not args.run and not args.export:
+            parser.error('argument -r/--run requires a value')
+
+        from ecosystem import utils
+
+        if args.solve and args.tools:
+            args.tools = eco.solve(*args.tools)
+            logger.debug('Solved tools: %s' % ', '.join(args.tools))
+
+        base = None
+        if args.from_previous:
+            base = utils.retrieve_environment()
+
+        if args.export:
+            if args.preset:
+                environment = eco.get_preset_environment(*args.preset)
             else:
-                environment = presets.merge(*[eco.get_preset(x)
-                                              for x in args.preset])
-                environment.remove_duplicates()
+                environment = eco.get_environment(*args.tools)
 
-            if not runcmd:
-                runcmd = preset.default_command
-                if not runcmd:
-                    raise ValueError('Preset does not have a default runcmd')
+            if args.export_path:
+                from ecosystem import export
+                output = export.ScriptCache().get_script(
+                    environment, args.export, base=base) + '\n'
+            else:
+                output = environment.export(args.export, base=base)
 
-        elif args.tools:
-            if not args.run:
-                parser.error('argument -r/--run requires a value')
+            report_startup(args.startup_budget)
+            sys.stdout.write(output)
+            return
 
-            environment = eco.get_environment(*args.tools)
+        response = None
+        if args.use_daemon:
+            from ecosystem import daemon
+            response = daemon.resolve(tools=args.tools, presets=args.preset,
+                                      base=base,
+                                      normalize_paths=args.normalize_paths)
 
-        prev_env = None
-        if args.from_previous:
-            env = utils.retrieve_environment()
-            prev_env = os.environment
-            os.environ = env
+        if response:
+            default_command = response['default_command']
+            call_kwargs = {'env': response['environ']}
+        else:
+            default_command = None
+            if args.preset:
+                environment = eco.get_preset_environment(*args.preset)
+                default_command = eco.get_preset(
+                    args.preset[0]).default_command
+            else:
+                environment = eco.get_environment(*args.tools)
+
+            call_kwargs = {'environment': environment, 'env': base}
 
-        with environment:
-            code = utils.call_process(runcmd,
-                                      detached=args.run_detached,
-                                      shell=args.run_shell)
+        if not runcmd:
+            runcmd = default_command
+            if not runcmd:
+                raise ValueError('Preset does not have a default runcmd')
 
-        if prev_env:
-            os.environ = prev_env
+        report_startup(args.startup_budget)
+        code = utils.call_process(runcmd,
+                                  detached=args.run_detached,
+                                  shell=args.run_shell,
+                                  **call_kwargs)
 
         raise SystemExit(code)
 
@@ -0,0 +1,445 @@
+import os
+import json
+import mmap
+import time
+import struct
+import logging
+import collections
+
+from ecosystem import errors
+from ecosystem import manifest
+from ecosystem import tool as ecotool
+from ecosystem import utils
+from ecosystem import versions as ecoversions
+from ecosystem._version import __version__
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'ECOBNDL\0'
+FORMAT = 1
+
+# Magic, format and length of the JSON index, followed by the index and the
+# JSON records it points to.
+_header = struct.Struct('>8sII')
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+class BundleEntry(ecotool.ToolEntry):
+    '''A ToolEntry whose requirements and environment are only read from the
+    bundle when first used.'''
+
+    __slots__ = ('_bundle', '_record')
+
+    def __init__(self, bundle, record, tool, version, platforms, source):
+        self.tool = tool
+        self.version = version
+        self.platforms = platforms
+        self.source = source
+        self._bundle = bundle
+        self._record = record
+
+    def __getattr__(self, name):
+        if name not in ('requires', 'environment', 'optional'):
+            raise AttributeError(name)
+
+        data = self._bundle.read(self._record)
+        ecotool.remember_references(data['references'])
+        self.requires = data['requires']
+        self.environment = data['environment']
+        self.optional = data['optional']
+        return getattr(self, name)
+
+
+class Bundle(object):
+    '''A compiled bundle, memory-mapped so only the records used are read.'''
+
+    def __init__(self, path, signature=None):
+        self.path = path
+        self.signature = signature
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, length = _header.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError('Not an ecosystem bundle')
+        if version != FORMAT:
+            raise ValueError('Unsupported bundle format %i' % version)
+
+        start = _header.size
+        self.index = json.loads(
+            self._mmap[start:start + length].decode('utf-8'))
+        self._start = start + length
+        self._records = {}
+
+    def __repr__(self):
+        return '<%s.%s "%s">' % (
+            __name__,
+            self.__class__.__name__,
+            self.path
+        )
+
+    def read(self, record):
+        offset, length = record
+        data = self._records.get(offset)
+        if data is None:
+            start = self._start + offset
+            data = self._records[offset] = json.loads(
+                self._mmap[start:start + length].decode('utf-8'))
+        return data
+
+    def stale(self, part, search_paths, check=None):
+        '''Why "tools" or "presets" no longer match the files in
+        search_paths, or None if they are up to date.
+
+        ``check`` (ECO_BUNDLE_CHECK) is "files" (default) to list the search
+        paths and compare every file, "dirs" to only list them or "none".
+        Files are compared with the manifest of their directory when it has
+        one, otherwise stat-ed.
+        '''
+        check = check or os.getenv('ECO_BUNDLE_CHECK') or 'files'
+        if self.index['ecosystem'] != __version__:
+            return 'compiled by ecosystem %s' % self.index['ecosystem']
+
+        index = self.index[part]
+        if index['search_paths'] != list(search_paths):
+            return 'compiled for other search paths'
+
+        if check == 'none':
+            return None
+
+        for directory, names in index['directories']:
+            if _list(directory, self.path) != names:
+                return 'files were added to or removed from "%s"' % directory
+
+        if check == 'dirs':
+            return None
+
+        manifests = {}
+        stats = {}
+        for path, _, _ in index['files']:
+            directory, name = os.path.split(path)
+            if directory not in manifests:
+                try:
+                    manifests[directory] = manifest.read_manifest(directory)
+                except (IOError, OSError):
+                    manifests[directory] = None
+
+            stats[path] = (manifests[directory] or {}).get(name)
+        stats.update(_stat_files(
+            [x for x, _, _ in index['files'] if stats[x] is None]))
+
+        for path, mtime, size in index['files']:
+            stat = stats[path]
+            if stat is None:
+                return '"%s" was removed' % path
+            if stat.st_mtime != mtime or stat.st_size != size:
+                return '"%s" changed' % path
+
+        return None
+
+    def tool_files(self, platform):
+        '''(env file, [BundleEntry]) pairs in discovery order, with the tools
+        supporting platform.'''
+        index = self.index['tools']
+        files = [(x, []) for x in index['sources']]
+        for name, tool, version, platforms, source, offset, length in \
+                index['entries']:
+            if ecotool.supports_platform(platforms, platform):
+                files[source][1].append(BundleEntry(
+                    self, (offset, length), tool, version, platforms,
+                    index['sources'][source]
+                ))
+        return files
+
+    def presets(self):
+        '''Parsed presets per file, and the expanded tools of each preset.'''
+        data = self.read(self.index['presets']['record'])
+        preset_files = collections.OrderedDict(
+            (x, y) for x, y in data['files'])
+        expanded = dict((x, tuple(y)) for x, y in data['expanded'].items())
+        return preset_files, expanded
+
+    def close(self):
+        self._mmap.close()
+
+
+def load(path, previous=None):
+    '''Open the bundle at path, or reuse previous if the file did not change.
+    Returns None when there is no readable bundle.'''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    signature = (stat.st_mtime, stat.st_size, stat.st_ino)
+    if previous is not None and previous.path == path and \
+            previous.signature == signature:
+        return previous
+
+    try:
+        return Bundle(path, signature)
+    except (IOError, OSError, ValueError, struct.error) as e:
+        logger.warn('Could not read bundle "%s": %s' % (path, e))
+        return None
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _stat_files(paths, workers=8, slow=0.0002):
+    '''{path: os.stat or None}. When the first stat takes longer than
+    ``slow`` seconds, as on network filesystems, the others are sent
+    concurrently.'''
+    if not paths:
+        return {}
+
+    start = time.time()
+    stats = {paths[0]: _stat(paths[0])}
+    paths = paths[1:]
+    if len(paths) < 2 or time.time() - start < slow:
+        stats.update((x, _stat(x)) for x in paths)
+        return stats
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(workers, len(paths)))
+    try:
+        stats.update(zip(paths, pool.map(_stat, paths)))
+    finally:
+        pool.close()
+    return stats
+
+
+def _list(directory, bundle_path):
+    '''Names in directory, except the bundle, the manifest and their
+    temporary files.'''
+    name = os.path.basename(bundle_path)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return None
+    ignored = (name, manifest.MANIFEST_NAME)
+    return sorted(
+        x for x in names if x not in ignored and
+        not x.startswith(tuple('.%s.' % y for y in ignored)))
+
+
+def _state(filehandler, search_paths, files, bundle_path):
+    directories = [
+        [x, _list(x, bundle_path)] for x in search_paths if x]
+    states = []
+    for path in files:
+        stat = filehandler.stat(path)
+        states.append([path, stat.st_mtime, stat.st_size])
+    return directories, states
+
+
+class _Records(object):
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def add(self, data):
+        chunk = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        record = [self.size, len(chunk)]
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        return record
+
+
+class _Problems(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.problems = []
+
+    def emit(self, record):
+        self.problems.append(record.getMessage())
+
+
+def _values(environment):
+    for value in environment.values():
+        values = [value]
+        if isinstance(value, dict):
+            values = [y for x, y in value.items() if x != 'mode']
+
+        for value in values:
+            if isinstance(value, (list, tuple, set)):
+                value = os.pathsep.join(value)
+            if isinstance(value, basestring):
+                yield value
+
+
+def _references(entry):
+    found = {}
+    for environment in [entry.environment] + list(entry.optional.values()):
+        for value in _values(environment):
+            found[value] = list(ecotool.references(value))
+    return found
+
+
+def _validate(source, entry):
+    platforms = entry.platforms
+    if isinstance(platforms, basestring):
+        platforms = [platforms]
+    platforms = [x for x in platforms if x != '*'] or [source.force_platform]
+
+    for platform in platforms:
+        try:
+            entry.build(source, force_platform=platform)
+        except Exception as e:
+            logger.warn('Tool "%s" from "%s" is invalid on %s: %s' % (
+                entry.name, entry.source, platform, e))
+
+
+def _pack_tools(source, records, bundle_path):
+    filehandler = source.filehandler
+    files = filehandler.collect(source.search_paths)
+    directories, states = _state(
+        filehandler, source.search_paths, [x[0] for x in files], bundle_path)
+    results = filehandler.read_files(files, 'read_env')
+
+    sources = []
+    entries = []
+    for (path, handler), (tools, error) in zip(files, results):
+        if error is not None:
+            logger.warn('Could not read "%s": %s' % (path, error))
+            continue
+
+        sources.append(path)
+        for _tool in tools:
+            # Versions defined together share a record.
+            parsed = source._parse_tools([_tool], path, all_platforms=True)
+            if not parsed:
+                continue
+
+            data = {
+                'requires': parsed[0].requires,
+                'environment': parsed[0].environment,
+                'optional': parsed[0].optional,
+            }
+            try:
+                data['references'] = _references(parsed[0])
+                record = records.add(data)
+            except Exception as e:
+                logger.warn('Could not pack tool "%s" from "%s": %s' % (
+                    parsed[0].tool, path, e))
+                continue
+
+            for entry in parsed:
+                _validate(source, entry)
+                entries.append([
+                    entry.name, entry.tool, entry.version, entry.platforms,
+                    len(sources) - 1
+                ] + record)
+
+    return {
+        'search_paths': list(source.search_paths),
+        'directories': directories,
+        'files': states,
+        'sources': sources,
+        'entries': entries,
+    }
+
+
+def _pack_presets(source, records, tools, bundle_path):
+    files = source.filehandler.collect(source.preset_search_paths)
+    directories, states = _state(
+        source.filehandler, source.preset_search_paths,
+        [x[0] for x in files], bundle_path)
+
+    names = set()
+    index = ecoversions.VersionIndex()
+    for name, tool, version, platforms, _, _, _ in tools['entries']:
+        names.add(name)
+        index.add(tool, version, name)
+
+    manager = source.presetmanager
+    expanded = {}
+    for name in manager.list_presets():
+        try:
+            expanded[name] = manager.get_preset(name).tools
+        except errors.CyclicDependencyError as e:
+            logger.warn('Preset "%s" is invalid: %s' % (name, e))
+            continue
+
+        for tool in manager.get_preset(name).raw_tools:
+            if tool in names or tool.startswith('preset:'):
+                continue
+            requirement = ecoversions.parse_requirement(tool)
+            if not requirement or not index.find(*requirement):
+                logger.warn('Preset "%s" uses unknown tool "%s"' % (
+                    name, tool))
+
+    record = records.add({
+        'files': [[x, y] for x, y in manager.preset_files().items()],
+        'expanded': expanded,
+    })
+    return {
+        'search_paths': list(source.preset_search_paths),
+        'directories': directories,
+        'files': states,
+        'record': record,
+    }
+
+
+def _write(path, index, records):
+    data = json.dumps(index, separators=(',', ':')).encode('utf-8')
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    utils.atomic_write(
+        path, b''.join([_header.pack(MAGIC, FORMAT, len(data)), data] +
+                       records.chunks),
+        mode=0o644)
+
+
+def compile_bundle(ecosystem, path):
+    '''Validate the tools and presets found in the search paths of
+    ecosystem and pack them into a bundle at path.
+
+    Every warning logged while reading them is a problem. The problems are
+    returned and nothing is written unless there are none.
+    '''
+    if not path:
+        raise ValueError('No bundle path, set ECO_BUNDLE')
+
+    # Read from the files, never from an existing bundle.
+    source = ecosystem.__class__(
+        env_search_paths=ecosystem.search_paths,
+        plugin_searach_paths=ecosystem.plugin_search_paths,
+        preset_search_paths=ecosystem.preset_search_paths,
+        force_platform=ecosystem.force_platform,
+        bundle_path='',
+        registry_path='',
+        lazy=True
+    )
+
+    problems = _Problems()
+    package_logger = logging.getLogger('ecosystem')
+    package_logger.addHandler(problems)
+    try:
+        source.pluginmanager
+        records = _Records()
+        tools = _pack_tools(source, records, path)
+        presets = _pack_presets(source, records, tools, path)
+    finally:
+        package_logger.removeHandler(problems)
+
+    if problems.problems:
+        return problems.problems
+
+    _write(path, {
+        'ecosystem': __version__,
+        'created': time.time(),
+        'tools': tools,
+        'presets': presets,
+    }, records)
+    return []
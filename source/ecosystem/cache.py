@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import logging
+
+from ecosystem import utils
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class DiscoveryCache(object):
+    '''Persistent cache of parsed env files keyed by path, mtime and size.'''
+
+    version = 1
+
+    # Files modified this recently are not cached: on coarse-grained
+    # filesystems a second write within the same tick would not change the
+    # mtime and the stale entry would be served forever.
+    racy_interval = 2.0
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._updated = {}
+        self._removed = set()
+        self._seen = set()
+        self.load()
+
+    def __repr__(self):
+        return '<%s.%s "%s">' % (
+            __name__,
+            self.__class__.__name__,
+            self.path
+        )
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+        if not isinstance(data, dict) or data.get('version') != self.version:
+            return {}
+
+        return data.get('entries', {})
+
+    def load(self):
+        self._entries = self._read()
+        self._updated = {}
+        self._removed = set()
+        self._seen = set()
+
+    def get(self, path, stat, ttl=None):
+        self._seen.add(path)
+        entry = self._entries.get(path)
+        if not entry:
+            return None
+
+        # Content hashes from manifests outlive copies that change mtimes.
+        digest = getattr(stat, 'hash', None)
+        if digest is not None and entry.get('hash') is not None:
+            if entry['hash'] != digest:
+                return None
+        elif entry['mtime'] != stat.st_mtime or \
+                entry['size'] != stat.st_size:
+            return None
+
+        if ttl is not None and time.time() - entry.get('time', 0) >= ttl:
+            return None
+
+        return entry['data']
+
+    def set(self, path, stat, data):
+        self._seen.add(path)
+        if time.time() - stat.st_mtime < self.racy_interval:
+            return
+
+        try:
+            json.dumps(data)
+        except (TypeError, ValueError):
+            logger.debug('Data of "%s" is not serializable. '
+                         'Not caching.' % path)
+            return
+
+        entry = {'mtime': stat.st_mtime, 'size': stat.st_size, 'data': data,
+                 'time': time.time()}
+        if getattr(stat, 'hash', None) is not None:
+            entry['hash'] = stat.hash
+        self._entries[path] = entry
+        self._updated[path] = entry
+        self._removed.discard(path)
+
+    def prune(self, directories):
+        '''Forget unseen files living in any of the given directories.'''
+        directories = set(os.path.normpath(x) for x in directories if x)
+        for path in list(self._entries):
+            if path in self._seen:
+                continue
+            if os.path.normpath(os.path.dirname(path)) not in directories:
+                continue
+
+            del self._entries[path]
+            self._updated.pop(path, None)
+            self._removed.add(path)
+
+    @property
+    def dirty(self):
+        return bool(self._updated or self._removed)
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            with _FileLock(self.path + '.lock'):
+                # Merge on top of what other processes wrote in the meantime
+                # so concurrent writers only ever add to each other's work.
+                entries = self._read()
+                entries.update(self._updated)
+                for path in self._removed:
+                    entries.pop(path, None)
+
+                utils.atomic_write(self.path, json.dumps(
+                    {'version': self.version, 'entries': entries},
+                    separators=(',', ':')
+                ))
+
+        except (IOError, OSError) as e:
+            logger.warn('Could not write discovery cache "%s": %s' % (
+                self.path, e))
+            return
+
+        self._entries = entries
+        self._updated = {}
+        self._removed = set()
+
+
+class _FileLock(object):
+    def __init__(self, path):
+        self.path = path
+        self._handle = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return self
+
+        try:
+            self._handle = open(self.path, 'a')
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX)
+        except (IOError, OSError):
+            self._handle = None
+
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        if self._handle is None:
+            return
+
+        fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+        self._handle.close()
+        self._handle = None
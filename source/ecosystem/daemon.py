@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import sys
+import signal
+import stat
+import socket
+import getpass
+import platform
+import logging
+import tempfile
+import threading
+import traceback
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from ecosystem import delta as ecodelta
+from ecosystem import errors
+from ecosystem import utils
+
+logger = logging.getLogger(__name__)
+
+# 2: environments are answered as a delta from the base.
+PROTOCOL_VERSION = 2
+
+
+def socket_path():
+    '''ECO_DAEMON_SOCKET, or a socket in the runtime directory of the user,
+    or in a private directory of theirs in the temp directory.'''
+    path = os.getenv('ECO_DAEMON_SOCKET')
+    if path:
+        return path
+
+    if os.getenv('XDG_RUNTIME_DIR'):
+        return os.path.join(os.getenv('XDG_RUNTIME_DIR'), 'ecosystem.sock')
+
+    return os.path.join(
+        tempfile.gettempdir(), 'ecosystem-%s' % getpass.getuser(),
+        'daemon.sock')
+
+
+def check_socket(path):
+    '''Raise UnsafePathError unless path is a socket only the current user
+    can connect to, in a directory no one else can write to. Whoever
+    answers on it decides the environment of the commands run.'''
+    utils.check_private(os.path.dirname(os.path.abspath(path)))
+
+    path_stat = os.lstat(path)
+    if not stat.S_ISSOCK(path_stat.st_mode):
+        raise errors.UnsafePathError('"%s" is not a socket' % path)
+    if hasattr(os, 'getuid') and path_stat.st_uid != os.getuid():
+        raise errors.UnsafePathError(
+            '"%s" is not owned by the current user' % path)
+    if path_stat.st_mode & 0o077:
+        raise errors.UnsafePathError(
+            '"%s" is accessible to other users' % path)
+
+
+def get_config(env_search_paths=None, preset_search_paths=None,
+               plugin_search_paths=None, force_platform=None):
+    '''Settings a daemon must share with a client to answer for it.'''
+    def paths(value, variable):
+        return value or os.getenv(variable, '').split(os.pathsep)
+
+    return {
+        'env': paths(env_search_paths, 'ECO_ENV'),
+        'preset': paths(preset_search_paths, 'ECO_PRESET_PATH'),
+        'plugin': paths(plugin_search_paths, 'ECO_PLUGIN_PATH'),
+        'platform': force_platform or platform.system().lower(),
+    }
+
+
+def resolve(tools=None, presets=None, base=None, normalize_paths=False,
+            config=None, path=None, timeout=10.0):
+    '''Ask a running daemon for an environment.
+
+    Returns the response dict, or None when no daemon could answer, in which
+    case the caller is expected to resolve in-process.
+    '''
+    path = path or socket_path()
+    if not os.path.exists(path):
+        return None
+
+    try:
+        check_socket(path)
+    except (OSError, errors.UnsafePathError) as e:
+        logger.warn('Not using the daemon: %s' % e)
+        return None
+
+    request = {
+        'version': PROTOCOL_VERSION,
+        'config': config or get_config(),
+        'tools': tools or [],
+        'presets': presets or [],
+        'base': dict(os.environ) if base is None else dict(base),
+        'normalize_paths': normalize_paths,
+    }
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(path)
+        connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        response = connection.makefile('rb').readline()
+    except (socket.error, socket.timeout) as e:
+        logger.debug('Daemon at "%s" is not available: %s' % (path, e))
+        return None
+    finally:
+        connection.close()
+
+    try:
+        response = json.loads(response.decode('utf-8'))
+    except ValueError:
+        logger.debug('Invalid response from daemon at "%s"' % path)
+        return None
+
+    if response.get('error'):
+        logger.debug('Daemon could not resolve: %s' % response['error'])
+        return None
+
+    delta = ecodelta.EnvironmentDelta.from_dict(response.pop('delta'))
+    response['environ'] = delta.applied(request['base'])
+    return response
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            response = self.server.process(request)
+        except Exception as e:
+            logger.debug(traceback.format_exc())
+            response = {'error': '%s: %s' % (e.__class__.__name__, e)}
+
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class ResolveServer(socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path=None, check_interval=1.0, **ecosystem_kwargs):
+        self.path = path or socket_path()
+        self.check_interval = check_interval
+        self.ecosystem_kwargs = ecosystem_kwargs
+        self.config = get_config(
+            env_search_paths=ecosystem_kwargs.get('env_search_paths'),
+            preset_search_paths=ecosystem_kwargs.get('preset_search_paths'),
+            plugin_search_paths=ecosystem_kwargs.get('plugin_searach_paths'),
+            force_platform=ecosystem_kwargs.get('force_platform'),
+        )
+
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._stamp = None
+        self.ecosystem = None
+        self.refresh()
+
+        utils.private_directory(os.path.dirname(os.path.abspath(self.path)))
+        self._remove_stale_socket()
+        socketserver.UnixStreamServer.__init__(
+            self, self.path, _RequestHandler)
+        os.chmod(self.path, 0o600)
+
+    def _remove_stale_socket(self):
+        if not os.path.exists(self.path):
+            return
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except socket.error:
+            os.remove(self.path)
+        else:
+            raise RuntimeError('A daemon is already serving "%s"' % self.path)
+        finally:
+            probe.close()
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _get_stamp(self):
+        stamp = []
+        for path in self.config['env'] + self.config['preset']:
+            if not os.path.isdir(path):
+                continue
+
+            stamp.append((path, os.stat(path).st_mtime))
+            for name in sorted(os.listdir(path)):
+                try:
+                    stat = os.stat(os.path.join(path, name))
+                except OSError:
+                    continue
+                stamp.append((name, stat.st_mtime, stat.st_size))
+
+        return stamp
+
+    def refresh(self, force=False):
+        now = time.time()
+        if not force and now - self._checked < self.check_interval:
+            return
+
+        with self._lock:
+            self._checked = now
+            stamp = self._get_stamp()
+            if not force and stamp == self._stamp:
+                return
+
+            from ecosystem import Ecosystem
+
+            logger.info('Discovering tools and presets')
+            self.ecosystem = Ecosystem(**self.ecosystem_kwargs)
+            self._stamp = stamp
+
+    def process(self, request):
+        if request.get('version') != PROTOCOL_VERSION:
+            return {'error': 'Unsupported protocol version %r' %
+                    request.get('version')}
+
+        if request.get('config') != self.config:
+            return {'error': 'Daemon serves a different configuration'}
+
+        self.refresh()
+        eco = self.ecosystem
+
+        default_command = None
+        if request.get('presets'):
+            environment = eco.get_preset_environment(*request['presets'])
+            default_command = eco.get_preset(
+                request['presets'][0]).default_command
+        else:
+            environment = eco.get_environment(*request['tools'])
+
+        environment.setPathNormalization(request.get('normalize_paths'))
+        delta = environment.resolve_delta(base=request['base'])
+        return {'delta': delta.to_dict(previous=False),
+                'default_command': default_command}
+
+
+def serve(path=None, **ecosystem_kwargs):
+    server = ResolveServer(path=path, **ecosystem_kwargs)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    logger.info('Serving environments on "%s"' % server.path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,137 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EnvironmentDelta(object):
+    '''The variables a resolved environment sets, modifies and unsets
+    compared to its base.
+
+    ``set`` and ``modified`` map keys to their new values, ``unset`` holds
+    the keys removed. ``previous`` keeps the base value of every modified and
+    unset key so the delta can be reverted.
+    '''
+
+    def __init__(self, set=None, modified=None, unset=None, previous=None):
+        self.set = dict(set or {})
+        self.modified = dict(modified or {})
+        self.unset = sorted(unset or [])
+        self.previous = dict(previous or {})
+
+    def __repr__(self):
+        return '<%s.%s "+%i ~%i -%i">' % (
+            __name__,
+            self.__class__.__name__,
+            len(self.set),
+            len(self.modified),
+            len(self.unset)
+        )
+
+    def __len__(self):
+        return len(self.set) + len(self.modified) + len(self.unset)
+
+    def __bool__(self):
+        return bool(len(self))
+
+    __nonzero__ = __bool__
+
+    def __eq__(self, other):
+        if not isinstance(other, EnvironmentDelta):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    @classmethod
+    def between(cls, base, environ):
+        '''The delta turning base into environ.'''
+        delta = cls()
+        for key, value in environ.items():
+            previous = base.get(key)
+            if previous is None:
+                delta.set[key] = value
+            elif previous != value:
+                delta.modified[key] = value
+                delta.previous[key] = previous
+
+        for key in base:
+            if key not in environ:
+                delta.unset.append(key)
+                delta.previous[key] = base[key]
+        delta.unset.sort()
+
+        return delta
+
+    @property
+    def changes(self):
+        '''Every key the delta sets, with its new value.'''
+        changes = dict(self.set)
+        changes.update(self.modified)
+        return changes
+
+    def inverse(self):
+        '''The delta undoing this one.'''
+        return EnvironmentDelta(
+            set=dict((x, self.previous[x]) for x in self.unset),
+            modified=dict((x, self.previous[x]) for x in self.modified),
+            unset=list(self.set),
+            previous=self.changes
+        )
+
+    def applied(self, base):
+        '''A copy of base with the delta applied.'''
+        environ = dict(base)
+        environ.update(self.changes)
+        for key in self.unset:
+            environ.pop(key, None)
+        return environ
+
+    def apply(self, environ=None):
+        '''Apply the delta in place, to os.environ by default. Only the keys
+        of the delta are touched.'''
+        if environ is None:
+            environ = os.environ
+
+        for key, value in self.changes.items():
+            environ[key] = value
+        for key in self.unset:
+            environ.pop(key, None)
+
+    def revert(self, environ=None):
+        '''Undo apply. Keys changed since by someone else keep their new
+        value.'''
+        if environ is None:
+            environ = os.environ
+
+        changes = self.changes
+        for key, value in changes.items():
+            if environ.get(key) != value:
+                logger.debug('Not reverting "%s", it changed since' % key)
+            elif key in self.previous:
+                environ[key] = self.previous[key]
+            else:
+                del environ[key]
+
+        for key in self.unset:
+            if key in environ:
+                logger.debug('Not reverting "%s", it was set since' % key)
+            else:
+                environ[key] = self.previous[key]
+
+    def to_dict(self, previous=True):
+        '''A JSON-serializable form, see from_dict. Without previous, the
+        delta can be applied but not reverted.'''
+        data = {
+            'set': self.set,
+            'modified': self.modified,
+            'unset': self.unset,
+        }
+        if previous:
+            data['previous'] = self.previous
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
@@ -2,18 +2,26 @@ import os
 import logging
 import traceback
 import platform
+import threading
 import collections
-import json
-import tempfile
 
+from ecosystem import delta as ecodelta
 from ecosystem import errors
+from ecosystem import export as ecoexport
 from ecosystem import handlers
 from ecosystem import plugins
 from ecosystem import tool as ecotool
 from ecosystem import presets
+from ecosystem import resolver as ecoresolver
+from ecosystem import solver as ecosolver
+from ecosystem import trace
+from ecosystem import utils
+from ecosystem import versions as ecoversions
 
 logger = logging.getLogger(__name__)
 
+BUNDLE_NAME = '.ecosystem.bundle'
+
 try:
     basestring
 except NameError:
@@ -24,107 +32,586 @@ class Ecosystem(object):
     def __init__(
             self, env_search_paths=None, plugin_searach_paths=None,
             preset_search_paths=None, force_platform=None,
-            normalize_paths=False):
+            normalize_paths=False, cache_path=None, discover_workers=None,
+            discover_executor='thread', snapshot_store=None, lazy=False,
+            bundle_path=None, registry_path=None):
         self.search_paths = env_search_paths or \
             os.getenv('ECO_ENV', '').split(os.pathsep)
+        self.plugin_search_paths = plugin_searach_paths or \
+            os.getenv('ECO_PLUGIN_PATH', '').split(os.pathsep)
+        self.preset_search_paths = preset_search_paths or \
+            os.getenv('ECO_PRESET_PATH', '').split(os.pathsep)
+        self.cache_path = cache_path or os.getenv('ECO_CACHE')
+        # An empty string disables the bundle.
+        self.bundle_path = bundle_path
+        if self.bundle_path is None:
+            self.bundle_path = os.getenv('ECO_BUNDLE')
+        if self.bundle_path is None:
+            self.bundle_path = next(
+                (os.path.join(x, BUNDLE_NAME) for x in self.search_paths
+                 if x), '')
+        # An empty string disables the registry.
+        self.registry_path = registry_path
+        if self.registry_path is None:
+            self.registry_path = os.getenv('ECO_REGISTRY')
+        self.discover_workers = discover_workers
+        self.discover_executor = discover_executor
+        self._snapshots = snapshot_store
 
         self.force_platform = force_platform or platform.system().lower()
+        self._normalize_paths = normalize_paths
 
         self._tools = {}
+        self._tool_files = collections.OrderedDict()
+        self._tool_objects = {}
+        self._version_index = None
+        self._solver = None
+        self._discovered = False
+        self._pluginmanager = None
+        self._presetmanager = None
+        self._watcher = None
+        self._bundle = None
+        self._registry = None
+        # Registry scope of the tools, None while they are held in memory.
+        self._scope = None
+
+        # Guards discovery and the memos, so a single instance can serve
+        # concurrent launches and a watcher thread.
+        self._lock = threading.RLock()
         self.filehandler = handlers.FileHandlerManager()
-        self.discover()
-        self.pluginmanager = plugins.PluginManager(self, plugin_searach_paths)
-        self.presetmanager = presets.PresetManager(self, preset_search_paths)
-        self._normalize_paths = normalize_paths
 
+        # Lazy instances only discover what is asked for, on first use.
+        if not lazy:
+            self.discover()
+            self.pluginmanager
+            self.presetmanager
+
+    @property
+    def pluginmanager(self):
+        if self._pluginmanager is None:
+            with self._lock:
+                if self._pluginmanager is None:
+                    self._pluginmanager = plugins.PluginManager(
+                        self, self.plugin_search_paths)
+        return self._pluginmanager
+
+    @property
+    def presetmanager(self):
+        if self._presetmanager is None:
+            with self._lock:
+                if self._presetmanager is None:
+                    # Presets may be stored in formats registered by plugins.
+                    self.pluginmanager
+                    self._presetmanager = presets.PresetManager(
+                        self, self.preset_search_paths)
+        return self._presetmanager
+
+    @property
+    def registry(self):
+        if self._registry is None and self.registry_path:
+            with self._lock:
+                if self._registry is None:
+                    from ecosystem import registry
+                    self._registry = registry.Registry(self.registry_path)
+        return self._registry
+
+    @property
+    def snapshots(self):
+        if self._snapshots is None:
+            from ecosystem import snapshots
+            self._snapshots = snapshots.SnapshotStore()
+        return self._snapshots
+
+    def _ensure_discovered(self):
+        if not self._discovered:
+            with self._lock:
+                if not self._discovered:
+                    # Env files may be stored in formats registered by
+                    # plugins.
+                    self.pluginmanager
+                    self.discover()
+
+    @trace.traced('Ecosystem.discover')
     def discover(self, append=False):
+        with self._lock:
+            self._discover(append=append)
+            self._discovered = True
+
+    def _discover(self, append=False):
         if not append:
             self._tools = {}
+            self._tool_files = collections.OrderedDict()
+        self._tool_objects = {}
+        self._version_index = None
+        self._solver = None
+        self._scope = None
+
+        if self.registry is not None:
+            self._discover_registry()
+            return
+
+        bundle = self.get_bundle('tools', self.search_paths)
+        if bundle is not None:
+            with trace.span('bundle', path=bundle.path):
+                for envfile_path, entries in bundle.tool_files(
+                        self.force_platform):
+                    self._add_tools(entries, envfile_path)
+            return
+
+        cache = self.get_cache()
+        with trace.span('collect'):
+            files = self.filehandler.collect(self.search_paths)
+        with trace.span('read', files=len(files)):
+            results = self.filehandler.read_files(
+                files, 'read_env', cache=cache,
+                workers=self.discover_workers,
+                executor=self.discover_executor
+            )
+
+        with trace.span('index'):
+            for (envfile_path, handler), (tools, error) in zip(
+                    files, results):
+                if error is not None:
+                    logger.warn(
+                        'Could not read "%s": %s' % (envfile_path, error))
+                    continue
 
-        for path in self.search_paths:
+                self._load_tools(tools, envfile_path)
 
-            if not os.path.isdir(path):
-                logger.debug('Path %s is not a directory. Skipping.' % path)
-                continue
+        if cache:
+            cache.prune(self.search_paths)
+            cache.save()
 
-            for envfile in os.listdir(path):
-                envfile_path = os.path.join(path, envfile)
-                if not os.path.isfile(envfile_path):
-                    continue
+    def _discover_registry(self):
+        from ecosystem import registry
 
-                ext = os.path.splitext(envfile)[-1]
-                handler = self.filehandler.file_handlers.get(ext)
+        self._scope = '%s:%s' % (
+            self.force_platform, os.pathsep.join(self.search_paths))
+        self._tools = registry.ToolView(self.registry, self._scope)
 
-                if not handler:
-                    continue
+        with trace.span('collect'):
+            files = self.filehandler.collect(self.search_paths)
+        outdated, removed = self.registry.outdated(
+            self._scope, files, stat=self.filehandler.stat)
+        self.registry.remove_files(self._scope, removed)
+
+        seqs = dict((x[0], i) for i, x in enumerate(files))
+        with trace.span('read', files=len(outdated)):
+            self._store_tools(outdated, seqs=seqs)
+
+    def _store_tools(self, files, seqs=None, keep=False):
+        '''Read env files, (path, handler, stat), into the registry and
+        return the names of the tools they define or defined.'''
+        results = self.filehandler.read_files(
+            [x[:2] for x in files], 'read_env',
+            workers=self.discover_workers, executor=self.discover_executor
+        )
+
+        affected = set()
+        for (path, handler, stat), (tools, error) in zip(files, results):
+            if error is not None:
+                logger.warn('Could not read "%s": %s' % (path, error))
+                if not keep:
+                    affected.update(
+                        self.registry.remove_files(self._scope, [path]))
+                continue
+
+            affected.update(self.registry.set_tools(
+                self._scope, path, self._parse_tools(tools, path),
+                stat=stat, seq=(seqs or {}).get(path)))
+
+        return affected
+
+    def get_cache(self):
+        if not self.cache_path:
+            return None
+
+        from ecosystem import cache
+        return cache.DiscoveryCache(self.cache_path)
+
+    def get_bundle(self, part, search_paths):
+        '''The compiled bundle, if there is one and its "tools" or "presets"
+        are up to date with search_paths.'''
+        if not self.bundle_path:
+            return None
+
+        from ecosystem import bundle
+        with self._lock:
+            self._bundle = bundle.load(self.bundle_path, self._bundle)
+            if self._bundle is None:
+                return None
+
+            reason = self._bundle.stale(part, search_paths)
+            if reason:
+                logger.warn('Ignoring out of date bundle "%s": %s' % (
+                    self.bundle_path, reason))
+                return None
+
+            return self._bundle
+
+    def compile(self, path=None):
+        '''Validate every tool and preset and pack them into a bundle at
+        path, by default bundle_path. Returns the problems found, nothing is
+        written unless there are none.'''
+        from ecosystem import bundle
+        return bundle.compile_bundle(self, path or self.bundle_path)
+
+    def write_manifests(self):
+        '''Regenerate the manifest of every env, preset and plugin search
+        path, so discovery reads it instead of listing them. Returns the
+        manifests written.'''
+        from ecosystem import manifest
+
+        written = []
+        directories = []
+        for path in (list(self.search_paths) +
+                     list(self.preset_search_paths) +
+                     list(self.plugin_search_paths)):
+            if path and path not in directories and os.path.isdir(path):
+                directories.append(path)
+
+        for path in directories:
+            written.append(manifest.write_manifest(path))
+
+        return written
+
+    def _parse_tools(self, tools, envfile_path, all_platforms=False):
+        entries = []
+        for _tool in tools:
+            try:
+                versions = _tool['version']
+            except KeyError:
+                logger.warn(
+                    'Tool from "%s" does not have any version.' %
+                    envfile_path
+                )
+                continue
+
+            if isinstance(versions, basestring):
+                versions = [versions]
 
+            for version in versions:
                 try:
-                    tools = handler.read_env(envfile_path)
+                    entry = ecotool.ToolEntry(
+                        tool=_tool['tool'],
+                        version=version,
+                        platforms=_tool.get('platforms', '*'),
+                        requires=_tool.get('requires', []),
+                        environment=_tool['environment'],
+                        optional=_tool.get('optional', {}),
+                        source=envfile_path
+                    )
+                    if not all_platforms and \
+                            not entry.supports(self.force_platform):
+                        message = (
+                            'Skipping tool "%s": '
+                            'not supported for platform "%s"'
+                        )
+                        logger.debug(message % (
+                            entry.name, self.force_platform))
+                        continue
+
+                    # Tools are built on first use, invalid definitions must
+                    # not override valid ones until then.
+                    if not all_platforms:
+                        entry.check(self.force_platform)
+
                 except Exception as e:
-                    logger.warn('Could not read "%s": %s' % (envfile_path, e))
+                    logger.warn(
+                        'Could not load env file "%s": %s.' % (
+                            envfile_path, e)
+                    )
                     logger.debug(traceback.format_exc())
                     continue
 
-                for _tool in tools:
-                    try:
-                        versions = _tool['version']
-                    except KeyError:
-                        logger.warn(
-                            'Tool from "%s" does not have any version.' %
-                            envfile_path
-                        )
-                        continue
+                entries.append(entry)
+
+        return entries
+
+    def _load_tools(self, tools, envfile_path):
+        self._add_tools(self._parse_tools(tools, envfile_path), envfile_path)
+
+    def _add_tools(self, entries, envfile_path):
+        # Files defined later override earlier ones, see _update_tool_files.
+        self._tool_files.pop(envfile_path, None)
+        self._tool_files[envfile_path] = entries
+
+        self._version_index = None
+        self._solver = None
+        for entry in entries:
+            if self._tools.get(entry.name):
+                logger.debug(
+                    'Overriding duplicate tool "%s"' %
+                    entry.name
+                )
+                self._tool_objects.pop(entry.name, None)
+
+            self._tools[entry.name] = entry
+
+    def _known_tool_files(self):
+        if self._scope is not None:
+            return self.registry.paths(self._scope)
+        return list(self._tool_files)
+
+    def _update_tool_files(self, paths):
+        known_paths = self._known_tool_files()
+        known = set(known_paths)
+        files = []
+        removed = []
+        for path in paths:
+            handler = self.filehandler.file_handlers.get(
+                os.path.splitext(path)[-1])
+            if handler and os.path.isfile(path):
+                files.append((path, handler))
+            elif path in known:
+                removed.append(path)
+
+        # Files keep the rank fresh discovery would give them, so a new file
+        # only overrides the files listed before it.
+        order = handlers.discovery_order(
+            [x for x in known_paths if x not in removed] +
+            [x[0] for x in files if x[0] not in known], self.search_paths)
+
+        if self._scope is not None:
+            affected = self.registry.remove_files(self._scope, removed)
+            self.registry.reorder(self._scope, order)
+            # Most likely saved halfway, keep what it defined so far.
+            affected.update(self._store_tools(
+                [x + (_stat(x[0]),) for x in files], keep=True,
+                seqs=dict((x, i) for i, x in enumerate(order))))
+            if affected:
+                self._version_index = None
+                self._solver = None
+            for name in affected:
+                self._tool_objects.pop(name, None)
+            return affected
+
+        affected = set()
+        for path in removed:
+            affected.update(x.name for x in self._tool_files.pop(path))
+
+        results = self.filehandler.read_files(files, 'read_env')
+        for (path, handler), (tools, error) in zip(files, results):
+            if error is not None:
+                # Most likely saved halfway, keep what it defined so far.
+                logger.warn('Could not read "%s": %s' % (path, error))
+                continue
+
+            entries = self._parse_tools(tools, path)
+            affected.update(x.name for x in self._tool_files.get(path, []))
+            affected.update(x.name for x in entries)
+            self._tool_files[path] = entries
+
+        self._tool_files = collections.OrderedDict(
+            (x, self._tool_files[x]) for x in order if x in self._tool_files)
 
-                    if isinstance(versions, basestring):
-                        versions = [versions]
-
-                    for version in versions:
-                        try:
-                            tool_obj = ecotool.Tool(
-                                ecosystem=self,
-                                tool=_tool['tool'],
-                                version=version,
-                                platforms=_tool.get('platforms', '*'),
-                                requires=_tool.get('requires', []),
-                                environment=_tool['environment'],
-                                optional=_tool.get('optional', {}),
-                                force_platform=self.force_platform,
-                                source=envfile_path
-                            )
-                            if not tool_obj.valid:
-                                message = (
-                                    'Skipping tool "%s": '
-                                    'not supported for platform "%s"'
-                                )
-                                logger.debug(message % (
-                                    tool_obj.name, self.force_platform))
-                                continue
-
-                        except Exception as e:
-                            logger.warn(
-                                'Could not load env file "%s": %s.' % (
-                                    envfile_path, e)
-                            )
-                            logger.debug(traceback.format_exc())
-                            continue
-
-                        if self._tools.get(tool_obj.name):
-                            logger.debug(
-                                'Overriding duplicate tool "%s"' %
-                                tool_obj.name
-                            )
-
-                        self._tools[tool_obj.name] = tool_obj
-
-    def get_tool(self, tool):
-        _tool = self._tools.get(tool)
-        if not _tool:
-            raise errors.ToolNotFoundError('Tool %s does not exist.' % tool)
-
-        return _tool
+        winners = {}
+        for entries in self._tool_files.values():
+            for entry in entries:
+                if entry.name in affected:
+                    winners[entry.name] = entry
+
+        if affected:
+            self._version_index = None
+            self._solver = None
+
+        for name in affected:
+            self._tool_objects.pop(name, None)
+            if name in winners:
+                self._tools[name] = winners[name]
+            else:
+                self._tools.pop(name, None)
+
+        return affected
+
+    def _watched_files(self, search_paths, known):
+        paths = set(known)
+        for path, handler in self.filehandler.collect(search_paths):
+            paths.add(path)
+        return paths
+
+    @trace.traced('Ecosystem.update_files')
+    def update_files(self, paths=None):
+        '''Re-read the given env and preset files after they changed.
+
+        Only tools and presets defined by those files are updated or evicted.
+        Without paths, every file in the search paths is checked. Returns a
+        dict with the names of the changed "tools" and "presets".
+        '''
+        with self._lock:
+            return self._update_files(paths)
+
+    def _update_files(self, paths):
+        changes = {'tools': set(), 'presets': set()}
+
+        if paths is None:
+            env_files = self._watched_files(
+                self.search_paths, self._known_tool_files())
+            preset_files = None
+        else:
+            env_files = _in_directories(paths, self.search_paths)
+            preset_files = _in_directories(paths, self.preset_search_paths)
+
+        if self._discovered and env_files:
+            changes['tools'] = self._update_tool_files(env_files)
+
+        if self._presetmanager is not None and (
+                preset_files is None or preset_files):
+            changes['presets'] = self._presetmanager.update_files(
+                preset_files)
+
+        return changes
+
+    def watch(self, callback=None, interval=1.0, backend=None):
+        '''Keep tools and presets up to date while their files change.
+
+        ``callback(ecosystem, changes)`` is called from the watcher thread
+        after each update that changed any tool or preset, with the dict
+        returned by update_files. ``backend`` is "inotify", "poll" or "auto"
+        (default, from ECO_WATCH_BACKEND), which polls network filesystems.
+        '''
+        from ecosystem import watch
+
+        self.stop_watching()
+        self._ensure_discovered()
+        self.presetmanager
+
+        def on_change(paths):
+            changes = self.update_files(paths)
+            if changes['tools'] or changes['presets']:
+                logger.debug('Updated tools %s and presets %s' % (
+                    sorted(changes['tools']), sorted(changes['presets'])))
+                if callback:
+                    callback(self, changes)
+
+        self._watcher = watch.Watcher(
+            self.search_paths + self.preset_search_paths, on_change,
+            interval=interval, backend=backend
+        )
+        self._watcher.start()
+        return self._watcher
+
+    @property
+    def watching(self):
+        return self._watcher is not None
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    @property
+    def version_index(self):
+        '''Versions of every tool family, rebuilt on first use after the
+        tools changed.'''
+        index = self._version_index
+        if index is None:
+            self._ensure_discovered()
+            with self._lock:
+                if self._version_index is None and self._scope is not None:
+                    from ecosystem import registry
+                    self._version_index = registry.RegistryVersionIndex(
+                        self.registry, self._scope)
+                elif self._version_index is None:
+                    self._version_index = ecoversions.VersionIndex(
+                        self._tools.values())
+                index = self._version_index
+        return index
+
+    @property
+    def solver(self):
+        index = self.version_index
+        with self._lock:
+            if self._solver is None or self._solver.index is not index:
+                self._solver = ecosolver.Solver(index, self._tools.copy())
+            return self._solver
+
+    def solve(self, *requests):
+        '''Return the names of the tools needed by requests, requirements
+        first.
+
+        Requests are tool names, families ("mtoa") or ranges
+        ("maya>=2016,<2018"). Requirements of every tool are pulled in
+        transitively, using the newest versions that satisfy all of them.
+        Raises UnsatisfiableRequirementsError when there are none.
+        '''
+        with trace.span('Ecosystem.solve', requests=list(requests)):
+            return self.solver.solve(requests)
+
+    def solve_environment(self, *requests):
+        return self.get_environment(*self.solve(*requests))
+
+    def find_versions(self, tool, specifiers=None):
+        '''Versions of a tool family matching specifiers such as
+        ">=2016,<2018", oldest first.'''
+        return [
+            str(x[0]) for x in self.version_index.find(tool, specifiers)
+        ]
+
+    def _find_tool(self, tool, specifiers):
+        found = self.version_index.latest(tool, specifiers)
+        if found is None:
+            raise errors.ToolNotFoundError(
+                'No version of tool %s matches "%s".' % (tool, specifiers))
+        return found[1]
+
+    def required_by(self, tool):
+        '''Names of the tools requiring any version of a tool family.'''
+        self._ensure_discovered()
+        with self._lock:
+            if self._scope is not None:
+                return self.registry.required_by(self._scope, tool)
+
+            return sorted(
+                name for name, entry in self._tools.items()
+                if any(ecosolver.parse_requirement(x)[0] == tool
+                       for x in entry.requires)
+            )
+
+    def latest(self, tool, specifiers=None):
+        '''The newest version of a tool family, optionally within a range.'''
+        return self.get_tool(self._find_tool(tool, specifiers))
+
+    def get_tool(self, tool, specifiers=None):
+        '''Return a tool by name ("maya2016.5"), or the newest version of a
+        family matching specifiers, given separately or in the name
+        ("maya>=2016,<2018").'''
+        if specifiers is not None:
+            return self.get_tool(self._find_tool(tool, specifiers))
+
+        _tool = self._tool_objects.get(tool)
+        if _tool:
+            return _tool
+
+        requirement = ecoversions.parse_requirement(tool)
+        if requirement:
+            return self.get_tool(*requirement)
+
+        self._ensure_discovered()
+        with self._lock:
+            _tool = self._tool_objects.get(tool)
+            if _tool:
+                return _tool
+
+            entry = self._tools.get(tool)
+            if not entry:
+                raise errors.ToolNotFoundError(
+                    'Tool %s does not exist.' % tool)
+
+            try:
+                _tool = entry.build(self, force_platform=self.force_platform)
+            except Exception as e:
+                logger.warn('Could not load tool "%s" from "%s": %s.' % (
+                    tool, entry.source, e))
+                raise
+
+            self._tool_objects[tool] = _tool
+            return _tool
 
     def list_tools(self):
-        return sorted(self._tools.keys())
+        self._ensure_discovered()
+        with self._lock:
+            return sorted(self._tools.keys())
 
     def list_presets(self):
         return self.presetmanager.list_presets()
@@ -140,17 +627,144 @@ class Ecosystem(object):
                 _tools.append(self.get_tool(tool))
 
         env = Environment(self, *_tools)
+        env.setPathNormalization(self._normalize_paths)
         return env
 
     def get_preset(self, name):
         return self.presetmanager.get_preset(name)
 
+    @trace.traced('Ecosystem.resolve_many')
+    def resolve_many(self, requests, base=None, store_previous=False,
+                     workers=None):
+        '''Resolve many tool lists or preset names against one base.
+
+        Each request is either a preset name or a list of tool names (which
+        may contain "preset:name" entries). Returns one environment dict per
+        request, in order. Requirement checks and expanded variable values
+        are shared across requests.
+        '''
+        if base is None:
+            base = os.environ
+        base = dict((str(x), str(y)) for x, y in base.items())
+
+        environments = []
+        for request in requests:
+            if isinstance(request, basestring):
+                environment = self.get_preset_environment(request)
+            else:
+                environment = self.get_environment(*request)
+            environments.append(environment)
+
+        shared = ecoresolver.Resolver(
+            base, normalize_paths=self._normalize_paths)
+
+        # All requests share the base, hence a single snapshot.
+        previous = None
+        if store_previous:
+            snapshot = self.snapshots.snapshot(base)
+            snapshot.commit()
+            previous = snapshot.path
+
+        checked = set()
+        for environment in environments:
+            key = tuple(x.name for x in environment.tools)
+            if key not in checked:
+                environment.check_requirements()
+                checked.add(key)
+
+        results = {}
+
+        def resolve(index):
+            environment = environments[index]
+            key = tuple(x.name for x in environment.tools)
+            if key not in results:
+                environ = environment.resolve_environ(
+                    base=base, store_previous=False,
+                    check_requirements=False, resolver=shared
+                )
+                if previous:
+                    environ['ECO_PREVIOUS_ENV'] = previous
+                results[key] = environ
+            return dict(results[key])
+
+        return utils.map_ordered(
+            resolve, [(x,) for x in range(len(environments))],
+            workers=workers)
+
+    def launch(self, command=None, tools=None, presets=None, base=None,
+               detached=False, store_previous=True, **kwargs):
+        '''Resolve tools or presets and run ``command`` in that environment.
+
+        The environment is resolved against ``base`` (os.environ by default)
+        and handed to the child process only, os.environ is never modified,
+        so any number of threads may launch concurrently. Without a command
+        the default command of the first preset is used. Extra keyword
+        arguments go to subprocess; returns the Popen object when detached
+        and the return code otherwise.
+        '''
+        if presets:
+            environment = self.get_preset_environment(*presets)
+            command = command or self.get_preset(presets[0]).default_command
+        else:
+            environment = self.get_environment(*(tools or []))
+
+        if not command:
+            raise ValueError('No command specified')
+
+        if not isinstance(command, (set, list, tuple)):
+            command = [command]
+        command = [str(x) for x in command]
+
+        kwargs['env'] = environment.resolve_environ(
+            base=base, store_previous=store_previous)
+        environment.commit_snapshot(kwargs['env'])
+
+        return utils.call_process(command, detached=detached, **kwargs)
+
+    def get_preset_environment(self, *names):
+        _presets = [self.get_preset(x) for x in names]
+        if len(_presets) == 1:
+            return _presets[0].get_environment()
+
+        environment = presets.merge(*_presets)
+        environment.remove_duplicates()
+        return environment
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _in_directories(paths, directories):
+    '''Paths directly inside one of the directories, spelled as collect
+    would spell them.'''
+    normalized = {}
+    for directory in directories:
+        if directory:
+            normalized.setdefault(
+                os.path.normcase(os.path.abspath(directory)), directory)
+
+    found = []
+    for path in paths:
+        directory = normalized.get(
+            os.path.normcase(os.path.abspath(os.path.dirname(path))))
+        if directory is not None:
+            found.append(os.path.join(directory, os.path.basename(path)))
+    return found
+
 
 class Environment(object):
     def __init__(self, ecosystem, *tools):
         self.tools = tools
         self.ecosystem = ecosystem
         self._normalize_paths = False
+        self._pending_snapshots = {}
+        # Deltas applied to os.environ by resolve, reverted by __exit__.
+        self._applied = []
+        self.delta = None
 
     def setPathNormalization(self, value):
         self._normalize_paths = value
@@ -163,16 +777,12 @@ class Environment(object):
         )
 
     def __enter__(self):
-        self._previous_environment = dict()
-        self._previous_environment.update(os.environ)
-
         self.environ = self.resolve()
-
+        self._applied.append(self.delta)
         return self
 
     def __exit__(self, exception_type, exception_val, trace):
-        os.environ.clear()
-        os.environ.update(self._previous_environment)
+        self._applied.pop().revert()
 
     def __add__(self, other):
         if not isinstance(other, Environment):
@@ -219,94 +829,122 @@ class Environment(object):
 
         self.tools = tooldict.values()
 
-    def _serializable_environ(self):
-        environ = {}
+    def _serializable_environ(self, environ=None):
+        if environ is None:
+            environ = os.environ
 
-        for key, val in os.environ.items():
-            environ[str(key)] = str(val)
-        return environ
+        serializable = {}
+        for key, val in environ.items():
+            serializable[str(key)] = str(val)
+        return serializable
 
     def resolve(self, store_previous=True):
-        self.check_requirements()
+        base = dict(os.environ)
+        environ = self.resolve_environ(
+            base=base, store_previous=store_previous)
+        self.commit_snapshot(environ)
+
+        # Only the variables the tools change are written to os.environ.
+        self.delta = ecodelta.EnvironmentDelta.between(base, environ)
+        self.delta.apply()
+        return environ
+
+    def resolve_delta(self, base=None, **kwargs):
+        '''The EnvironmentDelta from base, os.environ by default, to the
+        resolved environment. Takes the arguments of resolve_environ, and
+        stores the previous environment by default like resolve.'''
+        kwargs.setdefault('store_previous', True)
+        base = self._serializable_environ(base)
+        environ = self.resolve_environ(base=base, **kwargs)
+        self.commit_snapshot(environ)
+        return ecodelta.EnvironmentDelta.between(base, environ)
+
+    def export(self, shell='bash', base=None):
+        '''Return a script setting the resolved variables for ``shell``.'''
+        base = self._serializable_environ(base)
+        environ = self.resolve_environ(base=base, store_previous=False)
+        return ecoexport.format_script(
+            ecoexport.changed_variables(environ, base), shell)
+
+    def commit_snapshot(self, environ):
+        snapshot = self._pending_snapshots.pop(
+            environ.get('ECO_PREVIOUS_ENV'), None)
+        if snapshot:
+            snapshot.commit()
+
+    @trace.traced('Environment.resolve')
+    def resolve_environ(self, base=None, store_previous=False,
+                        check_requirements=True, resolver=None):
+        '''The resolved environment as a dict, os.environ is not touched.
+
+        With store_previous, base is snapshotted for ECO_PREVIOUS_ENV. The
+        snapshot is only written by commit_snapshot, once the environment is
+        handed to a process.
+        '''
+        if base is None:
+            base = os.environ
+
+        environ = self._serializable_environ(base)
+
+        if check_requirements:
+            with trace.span('check_requirements'):
+                self.check_requirements()
 
         variables = []
 
         for tool in self.tools:
-            for var in self.sort_by_dependency(tool.envs):
+            for var in tool.envs:
                 variables.append(var)
 
-        var_keys = [x.key.upper() for x in variables]
-
         if store_previous:
-            destination = tempfile.NamedTemporaryFile(suffix='.json',
-                                                      prefix='ecosystem.dump.',
-                                                      delete=False)
-            with open(destination.name, 'w') as f:
-                json.dump(self._serializable_environ(), f, indent=4)
-
-            os.environ['ECO_PREVIOUS_ENV'] = destination.name
-
-        for curr_var in variables:
-
-            for dependency in curr_var.get_dependencies():
-                if dependency not in var_keys + list(os.environ.keys()):
-                    raise errors.MissingDependencyError(
-                        'Variable "%s" of tool "%s" cannot be resolved: '
-                        'Environment "%s" is missing' % (
-                            curr_var.key,
-                            curr_var.tool.name,
-                            dependency
-                        )
-                    )
+            with trace.span('snapshot'):
+                snapshot = self.ecosystem.snapshots.snapshot(environ)
+            self._pending_snapshots[snapshot.path] = snapshot
+            environ['ECO_PREVIOUS_ENV'] = snapshot.path
 
-            prev = os.environ.get(curr_var.key, '')
-            prev = [x for x in prev.split(os.pathsep) if x]
-            if self._normalize_paths:
-                prev = [os.path.normpath(x) for x in prev]
-
-            if curr_var.mode() == 'append':
-                prev.append(curr_var.value)
-            elif curr_var.mode() == 'prepend':
-                prev.insert(0, curr_var.value)
-            elif curr_var.mode() == 'expand':
-                prev = [os.path.expandvars(curr_var.value)]
-            elif curr_var.mode() == 'default':
-                prev = [os.environ.get(curr_var.key, curr_var.value)]
-            else:
-                raise ValueError('Variable "{}" has an unsupported mode "{}"'
-                                 .format(curr_var.key, curr_var.mode()))
+        if resolver is None:
+            resolver = ecoresolver.Resolver(
+                environ, normalize_paths=self._normalize_paths)
 
-            os.environ[str(curr_var.key)] = str(os.pathsep.join(prev))
-
-        for i in range(3):
-            for env_name, env_value in os.environ.items():
-                os.environ[env_name] = os.path.expandvars(env_value)
+        with trace.span('resolve_variables', variables=len(variables)):
+            environ.update(resolver.resolve(variables))
 
         tools = ','.join([x.name for x in self.tools])
-        os.environ['ECO_SESSION_TOOLS'] = str(tools)
-        os.environ['ECO_ENV'] = os.pathsep.join(self.ecosystem.search_paths)
-        os.environ['ECO_PRESET_PATH'] = os.pathsep.join(
-            self.ecosystem.presetmanager.search_paths)
-        os.environ['ECO_PLUGIN_PATH'] = os.pathsep.join(
-            self.ecosystem.pluginmanager.search_paths)
-
-        environ = dict()
-        environ.update(os.environ)
+        environ['ECO_SESSION_TOOLS'] = str(tools)
+        environ['ECO_ENV'] = os.pathsep.join(self.ecosystem.search_paths)
+        environ['ECO_PRESET_PATH'] = os.pathsep.join(
+            self.ecosystem.preset_search_paths)
+        environ['ECO_PLUGIN_PATH'] = os.pathsep.join(
+            self.ecosystem.plugin_search_paths)
+
         return environ
 
     def sort_by_dependency(self, variables):
-        return sorted(variables, key=lambda x: len(x.dependencies))
+        return ecoresolver.sort_variables(variables)
 
     def check_requirements(self):
-        tool_names = [x.tool for x in self.tools]
+        families = {}
+        for tool in self.tools:
+            families.setdefault(tool.tool, []).append(tool.version)
+
         for tool in self.tools:
             for requirement in tool.requires:
-                if requirement not in tool_names:
+                family, specifiers = ecosolver.parse_requirement(requirement)
+                if family not in families:
                     raise errors.MissingRequirementError(
                         'Tool "%s" misses requirement "%s"' % (
                             tool.name, requirement)
                     )
 
+                specifier = ecoversions.get_specifier(specifiers)
+                if not any(specifier.contains(x, prereleases=True)
+                           for x in families[family]):
+                    raise errors.MissingRequirementError(
+                        'Tool "%s" requires "%s", found %s' % (
+                            tool.name, requirement, ', '.join(
+                                family + x for x in families[family]))
+                    )
+
     def get_environ(self):
         with self:
             return self.environ
@@ -12,3 +12,25 @@ class ToolNotFoundError(Exception):
 
 class PresetNotFoundError(Exception):
     '''Raised when attempting to retrieve an non-existing preset'''
+
+
+class CyclicDependencyError(Exception):
+    '''Raised when dependencies reference each other in a loop.'''
+
+    def __init__(self, message, chain=None):
+        super(CyclicDependencyError, self).__init__(message)
+        self.chain = chain or []
+
+
+class UnsafePathError(Exception):
+    '''Raised when a path other users could write to is used for files
+    that end up in the environment of the current user.'''
+
+
+class UnsatisfiableRequirementsError(MissingRequirementError):
+    '''Raised when no set of tool versions meets all requirements.'''
+
+    def __init__(self, message, family=None, constraints=None):
+        super(UnsatisfiableRequirementsError, self).__init__(message)
+        self.family = family
+        self.constraints = list(constraints or [])
@@ -0,0 +1,152 @@
+import os
+import json
+import hashlib
+import getpass
+import logging
+import tempfile
+
+from ecosystem import delta as ecodelta
+from ecosystem import utils
+
+logger = logging.getLogger(__name__)
+
+# Variables set by resolve for bookkeeping, always exported.
+SESSION_VARIABLES = (
+    'ECO_SESSION_TOOLS', 'ECO_ENV', 'ECO_PRESET_PATH', 'ECO_PLUGIN_PATH')
+
+
+def _posix(key, value):
+    return "export %s='%s'" % (key, value.replace("'", "'\\''"))
+
+
+def _csh(key, value):
+    value = value.replace("'", "'\\''").replace('!', '\\!')
+    return "setenv %s '%s'" % (key, value)
+
+
+def _bat(key, value):
+    return 'set "%s=%s"' % (key, value.replace('%', '%%'))
+
+
+def _powershell(key, value):
+    return "$env:%s = '%s'" % (key, value.replace("'", "''"))
+
+
+def _dotenv(key, value):
+    value = value.replace('\\', '\\\\').replace('"', '\\"')
+    return '%s="%s"' % (key, value)
+
+
+# shell: (line formatter, header, extension)
+SHELLS = {
+    'bash': (_posix, '#!/usr/bin/env bash', '.sh'),
+    'zsh': (_posix, '#!/usr/bin/env zsh', '.sh'),
+    'sh': (_posix, '#!/bin/sh', '.sh'),
+    'tcsh': (_csh, '#!/usr/bin/env tcsh', '.csh'),
+    'csh': (_csh, '#!/bin/csh', '.csh'),
+    'bat': (_bat, '@echo off', '.bat'),
+    'powershell': (_powershell, '', '.ps1'),
+    'dotenv': (_dotenv, '', '.env'),
+}
+
+
+def changed_variables(environ, base):
+    changed = ecodelta.EnvironmentDelta.between(base, environ).changes
+    for key in SESSION_VARIABLES:
+        if key in environ:
+            changed[key] = environ[key]
+    return changed
+
+
+def get_shell(shell):
+    try:
+        return SHELLS[shell]
+    except KeyError:
+        raise ValueError('Unsupported shell "%s", expected one of %s' % (
+            shell, ', '.join(sorted(SHELLS))))
+
+
+def format_script(variables, shell):
+    formatter, header, extension = get_shell(shell)
+    lines = [header] if header else []
+    lines += [formatter(key, variables[key]) for key in sorted(variables)]
+    return '\n'.join(lines) + '\n'
+
+
+class ScriptCache(object):
+    '''Activation scripts on disk, keyed by everything they depend on.'''
+
+    def __init__(self, root=None):
+        self.root = root or os.getenv('ECO_EXPORT_DIR') or os.path.join(
+            tempfile.gettempdir(), 'ecosystem-%s-exports' % getpass.getuser())
+
+    def __repr__(self):
+        return '<%s.%s "%s">' % (
+            __name__,
+            self.__class__.__name__,
+            self.root
+        )
+
+    def key(self, environment, shell, base):
+        ecosystem = environment.ecosystem
+        digest = hashlib.sha1()
+        digest.update(json.dumps([
+            shell,
+            ecosystem.force_platform,
+            environment._normalize_paths,
+            [x.name for x in environment.tools],
+            ecosystem.search_paths,
+            ecosystem.preset_search_paths,
+            ecosystem.plugin_search_paths,
+        ]).encode('utf-8'))
+
+        for source in sorted(set(x.source for x in environment.tools)):
+            digest.update(source.encode('utf-8'))
+            with open(source, 'rb') as f:
+                digest.update(hashlib.sha1(f.read()).digest())
+
+        # Only the base variables the tools touch or reference matter.
+        base_keys = dict((x.upper(), x) for x in base)
+        names = set()
+        for tool in environment.tools:
+            for variable in tool.envs:
+                names.add(variable.key)
+                names.update(variable.dependencies)
+
+        relevant = []
+        for name in sorted(names):
+            key = name if name in base else base_keys.get(name.upper())
+            relevant.append((name, base.get(key) if key else None))
+        digest.update(json.dumps(relevant).encode('utf-8'))
+
+        return digest.hexdigest()
+
+    def path(self, key, shell):
+        extension = get_shell(shell)[2]
+        return os.path.join(self.root, 'ecosystem.%s%s' % (key, extension))
+
+    def get_script(self, environment, shell, base=None):
+        '''Return the path of the activation script, writing it if needed.
+
+        Scripts get sourced, so the root must be private to the current
+        user: it is created with mode 0700, and UnsafePathError is raised
+        when an existing one belongs to someone else or others can write to
+        it.
+        '''
+        get_shell(shell)
+        utils.private_directory(self.root)
+
+        if base is None:
+            base = os.environ
+        base = dict((str(x), str(y)) for x, y in base.items())
+
+        path = self.path(self.key(environment, shell, base), shell)
+        if os.path.isfile(path):
+            utils.check_private(path, directory=False)
+            return path
+
+        script = environment.export(shell, base=base)
+        utils.atomic_write(path, script)
+
+        logger.debug('Wrote activation script "%s"' % path)
+        return path
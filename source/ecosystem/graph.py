@@ -0,0 +1,112 @@
+from ecosystem import errors
+
+_VISITING = 1
+_DONE = 2
+
+
+def toposort(nodes, edges, label='node', allow_cycles=False):
+    '''Order nodes so that each one comes after all of its dependencies.
+
+    Nodes keep their given order wherever the dependencies allow it.
+    Dependencies missing from ``nodes`` are ignored. Cycles raise
+    CyclicDependencyError, unless ``allow_cycles``: nodes depending on each
+    other then keep their given order, after what the group depends on.
+    '''
+    if allow_cycles:
+        position = dict((x, i) for i, x in enumerate(nodes))
+        return [
+            x for group in strongly_connected(nodes, edges)
+            for x in sorted(group, key=position.get)
+        ]
+
+    nodes = list(nodes)
+    known = set(nodes)
+    state = {}
+    order = []
+
+    for root in nodes:
+        if root in state:
+            continue
+
+        state[root] = _VISITING
+        stack = [(root, iter(edges.get(root, ())))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if child not in known:
+                    continue
+
+                child_state = state.get(child)
+                if child_state is None:
+                    state[child] = _VISITING
+                    stack.append((child, iter(edges.get(child, ()))))
+                    break
+
+                if child_state == _VISITING:
+                    path = [x[0] for x in stack]
+                    chain = path[path.index(child):] + [child]
+                    raise errors.CyclicDependencyError(
+                        'Cyclic %s dependency: %s' % (
+                            label, ' -> '.join(chain)),
+                        chain
+                    )
+            else:
+                stack.pop()
+                state[node] = _DONE
+                order.append(node)
+
+    return order
+
+
+def strongly_connected(nodes, edges):
+    '''Groups of nodes that depend on each other, each group after the
+    groups it depends on (Tarjan). Dependencies missing from ``nodes`` are
+    ignored.'''
+    nodes = list(nodes)
+    known = set(nodes)
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    groups = []
+
+    for root in nodes:
+        if root in index:
+            continue
+
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(edges.get(root, ())))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in known:
+                    continue
+
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(edges.get(child, ()))))
+                    break
+
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+
+                if low[node] == index[node]:
+                    group = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        group.append(member)
+                        if member == node:
+                            break
+                    groups.append(group)
+
+    return groups
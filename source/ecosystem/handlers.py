@@ -1,8 +1,13 @@
 import json
 import os
+import time
 import logging
-import imp
-import sys
+import threading
+import traceback
+
+from ecosystem import trace
+from ecosystem import utils
+from ecosystem import manifest
 
 logger = logging.getLogger(__name__)
 
@@ -10,6 +15,8 @@ logger = logging.getLogger(__name__)
 class FileHandlerManager(object):
     def __init__(self):
         self.file_handlers = {}
+        # What the manifests of the search paths record of their files.
+        self._manifested = {}
         self.register_handler(EnvFileHandler())
         self.register_handler(JsonHandler())
         self.register_handler(PythonHandler())
@@ -31,10 +38,122 @@ class FileHandlerManager(object):
 
         return handler.read(path) or []
 
+    def collect(self, search_paths):
+        files = []
+        for path in search_paths:
+            with trace.span('listdir', category='search_path', path=path):
+                listed = manifest.list_directory(path)
+
+            if listed is None:
+                logger.debug('Path %s is not a directory. Skipping.' % path)
+                continue
+
+            for file_path, info in listed:
+                handler = self.file_handlers.get(
+                    os.path.splitext(file_path)[-1])
+                if not handler:
+                    continue
+
+                if info is not None:
+                    self._manifested[file_path] = info
+                else:
+                    self._manifested.pop(file_path, None)
+                files.append((file_path, handler))
+
+        return files
+
+    def stat(self, path):
+        '''What the manifest records of a collected file, or its os.stat.'''
+        info = self._manifested.get(path)
+        if info is not None:
+            return info
+        return os.stat(path)
+
+    def read_files(self, files, method, cache=None, workers=None,
+                   executor='thread'):
+        results = [None] * len(files)
+        stats = {}
+        pending = []
+
+        for index, (file_path, handler) in enumerate(files):
+            if cache is None or not handler.cacheable:
+                pending.append(index)
+                continue
+
+            try:
+                stat = self.stat(file_path)
+            except OSError as e:
+                results[index] = (None, str(e))
+                continue
+
+            data = cache.get(file_path, stat, ttl=handler.cache_ttl)
+            if data is not None:
+                results[index] = (data, None)
+                continue
+
+            stats[index] = stat
+            pending.append(index)
+
+        arguments = [(files[x][1], method, files[x][0]) for x in pending]
+        try:
+            read = utils.map_ordered(
+                read_file, arguments, workers=workers, executor=executor)
+        except Exception as e:
+            logger.warn('Parallel read failed, reading serially: %s' % e)
+            logger.debug(traceback.format_exc())
+            read = utils.map_ordered(read_file, arguments)
+
+        for index, result in zip(pending, read):
+            results[index] = result
+            if index in stats and result[1] is None:
+                cache.set(files[index][0], stats[index], result[0])
+
+        return results
+
+
+def discovery_order(paths, search_paths):
+    '''paths sorted as collect lists them, by search path and then by name.
+    Paths outside the search paths come last, in their current order.'''
+    index = {}
+    for i, directory in enumerate(search_paths):
+        if directory:
+            index.setdefault(
+                os.path.normcase(os.path.abspath(directory)), i)
+
+    def key(path):
+        i = index.get(
+            os.path.normcase(os.path.abspath(os.path.dirname(path))))
+        if i is None:
+            return (len(index), '')
+        return (i, os.path.basename(path))
+
+    return sorted(paths, key=key)
+
+
+def read_file(handler, method, file_path):
+    span = trace.span(
+        os.path.basename(file_path), category='file', path=file_path,
+        handler=handler.__class__.__name__, method=method
+    )
+    try:
+        with span:
+            return getattr(handler, method)(file_path), None
+    except Exception as e:
+        logger.debug(traceback.format_exc())
+        return None, str(e)
+
 
 class BaseFileHandler(object):
     extensions = []
 
+    # Whether parsed results may be stored in the discovery cache. Handlers
+    # whose output depends on more than the file contents must disable it.
+    cacheable = True
+
+    # Seconds after which cached results are read again even if the file
+    # did not change, None to keep them until it does.
+    cache_ttl = None
+
     def read_env(self, file_path):
         raise NotImplementedError()
 
@@ -65,37 +184,81 @@ class JsonHandler(BaseFileHandler):
 
 
 class PythonHandler(BaseFileHandler):
+    '''Calls ``get_tools`` or ``get_presets`` of Python env and preset files.
+
+    These usually scan the filesystem, so their results are reused for
+    ``ttl`` seconds (ECO_PY_CACHE_TTL, 0 disables it) unless the file itself
+    changes.
+    '''
+
     extensions = ['.py']
 
-    def check_compatibility(self):
-        if not sys.version_info[0] == 2:
-            raise NotImplementedError('Python 3 not supported.')
+    def __init__(self, ttl=None):
+        if ttl is None:
+            try:
+                ttl = float(os.getenv('ECO_PY_CACHE_TTL') or 0)
+            except ValueError:
+                logger.warn('Invalid ECO_PY_CACHE_TTL "%s"' %
+                            os.getenv('ECO_PY_CACHE_TTL'))
+                ttl = 0
+
+        self.cache_ttl = ttl
+        self._results = {}
+        self._lock = threading.Lock()
+
+    # Handlers are sent to the workers of the process executor. The lock
+    # cannot be pickled and the results are only useful in this process.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_results'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def cacheable(self):
+        return self.cache_ttl > 0
 
     def read_module(self, file_path):
-        self.check_compatibility()
+        return utils.load_module(file_path, 'env')
 
-        module = imp.load_source(
-            os.path.splitext(os.path.split(file_path)[-1])[0],
-            file_path
-        )
-        return module
+    def call(self, file_path, function):
+        if not self.cacheable:
+            return self._call(file_path, function)
 
-    def read_env(self, file_path):
+        stat = os.stat(file_path)
+        signature = (stat.st_mtime, stat.st_size)
+        key = (file_path, function)
+        with self._lock:
+            cached = self._results.get(key)
+
+        if cached is not None and cached[0] == signature and \
+                time.time() - cached[1] < self.cache_ttl:
+            return cached[2]
+
+        now = time.time()
+        result = self._call(file_path, function)
+        with self._lock:
+            self._results[key] = (signature, now, result)
+        return result
+
+    def _call(self, file_path, function):
         module = self.read_module(file_path)
 
-        if not hasattr(module, 'get_tools'):
+        if not hasattr(module, function):
             logger.warn(
-                'Env file "%s" does not have "get_tools" function' % file_path
+                'Env file "%s" does not have "%s" function' % (
+                    file_path, function)
             )
             return []
 
-        return module.get_tools()
+        return getattr(module, function)()
 
-    def read_preset(self, file_path):
-        module = self.read_module(file_path)
-
-        if not hasattr(module, 'get_presets'):
-            logger.warn('Env file "%s" does not have "get_presets" function')
-            return []
+    def read_env(self, file_path):
+        return self.call(file_path, 'get_tools')
 
-        return module.get_presets()
+    def read_preset(self, file_path):
+        return self.call(file_path, 'get_presets')
@@ -0,0 +1,106 @@
+import os
+import json
+import errno
+import hashlib
+import logging
+import collections
+
+from ecosystem import utils
+
+_scandir = None
+if not hasattr(os, 'scandir'):
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        pass
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = '.ecosystem.manifest'
+VERSION = 1
+
+# What a manifest records of a file, used in place of os.stat.
+FileInfo = collections.namedtuple('FileInfo', 'st_mtime st_size hash')
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(directory):
+    '''{name: FileInfo} of the manifest in directory. Raises IOError or
+    OSError when there is none.'''
+    with open(os.path.join(directory, MANIFEST_NAME), 'r') as f:
+        try:
+            data = json.load(f)
+        except ValueError as e:
+            raise IOError('Invalid manifest: %s' % e)
+
+    if not isinstance(data, dict) or data.get('version') != VERSION:
+        raise IOError('Unsupported manifest version')
+
+    return dict(
+        (name, FileInfo(mtime, size, digest))
+        for name, size, mtime, digest in data['files']
+    )
+
+
+def _scan(directory):
+    scandir = getattr(os, 'scandir', _scandir)
+    if scandir is None:
+        return sorted(
+            x for x in os.listdir(directory)
+            if os.path.isfile(os.path.join(directory, x))
+        )
+
+    return sorted(x.name for x in scandir(directory) if x.is_file())
+
+
+def list_directory(directory):
+    '''(path, FileInfo or None) of the files in directory, by name.
+
+    The manifest is trusted when there is one, so a single file is read.
+    Otherwise the directory is scanned once, and no information is known
+    about the files. Returns None when the directory does not exist.
+    '''
+    try:
+        files = read_manifest(directory)
+        return [
+            (os.path.join(directory, x), files[x]) for x in sorted(files)]
+    except (IOError, OSError) as e:
+        if getattr(e, 'errno', None) not in (errno.ENOENT, errno.ENOTDIR):
+            logger.warn('Ignoring manifest of "%s": %s' % (directory, e))
+
+    try:
+        names = _scan(directory)
+    except OSError:
+        return None
+
+    return [
+        (os.path.join(directory, x), None) for x in names
+        if x != MANIFEST_NAME
+    ]
+
+
+def write_manifest(directory):
+    '''Record the name, size, mtime and content hash of every file in
+    directory. Returns the manifest path.'''
+    files = []
+    for name in _scan(directory):
+        if name == MANIFEST_NAME or name.startswith('.%s.' % MANIFEST_NAME):
+            continue
+
+        path = os.path.join(directory, name)
+        stat = os.stat(path)
+        files.append([name, stat.st_size, stat.st_mtime, file_hash(path)])
+
+    path = os.path.join(directory, MANIFEST_NAME)
+    utils.atomic_write(path, json.dumps(
+        {'version': VERSION, 'files': files}, separators=(',', ':')),
+        mode=0o644)
+
+    return path
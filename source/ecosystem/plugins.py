@@ -1,9 +1,11 @@
 import os
-import imp
 import logging
-import sys
 import traceback
 
+from ecosystem import trace
+from ecosystem import utils
+from ecosystem import manifest
+
 logger = logging.getLogger(__name__)
 
 
@@ -15,35 +17,33 @@ class PluginManager(object):
         self.ecosystem = ecosystem
         self.discover()
 
+    @trace.traced('PluginManager.discover')
     def discover(self):
         if not any(self.search_paths):
             return
         for path in self.search_paths:
-            if not os.path.isdir(path):
+            listed = manifest.list_directory(path)
+            if listed is None:
                 logger.warn('Path %s is not a directory. Skipping.' % path)
                 continue
 
-            for plugin in os.listdir(path):
-                plugin_path = os.path.join(path, plugin)
-                if not os.path.isfile(plugin_path):
-                    continue
-
+            for plugin_path, _ in listed:
+                plugin = os.path.basename(plugin_path)
                 name, ext = os.path.splitext(plugin)
 
                 if not ext == '.py':
                     continue
 
-                if sys.version_info[0] == 2:
-                    try:
-                        module = imp.load_source(name, plugin_path)
-                    except Exception as e:
-                        logger.warn(
-                            'Could not load plugin "%s": %s' % (plugin_path, e)
-                        )
-                        logger.debug(traceback.format_exc())
-                        continue
-                else:
-                    raise NotImplementedError('Python 3 not supported.')
+                try:
+                    with trace.span(plugin, category='file',
+                                    path=plugin_path, handler='plugin'):
+                        module = utils.load_module(plugin_path, 'plugin')
+                except Exception as e:
+                    logger.warn(
+                        'Could not load plugin "%s": %s' % (plugin_path, e)
+                    )
+                    logger.debug(traceback.format_exc())
+                    continue
 
                 if not hasattr(module, 'initialize'):
                     logger.warn(
@@ -0,0 +1,287 @@
+import os
+import re
+import time
+import logging
+import threading
+import traceback
+import subprocess
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class Job(object):
+    '''A command launched by a LaunchPool, with its exit code and timings.'''
+
+    def __init__(self, pool, index, command, name=None, environment=None,
+                 base=None, env=None, **kwargs):
+        self.pool = pool
+        self.index = index
+        self.command = [str(x) for x in command]
+        self.name = name or os.path.basename(self.command[0])
+        self.environment = environment
+        self.base = base
+        self.env = env
+        self.kwargs = kwargs
+
+        self.state = PENDING
+        self.process = None
+        self.returncode = None
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.log_path = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<%s.%s "%s">' % (
+            __name__,
+            self.__class__.__name__,
+            self.name
+        )
+
+    @property
+    def duration(self):
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def done(self):
+        return self.state in (FINISHED, FAILED, CANCELLED)
+
+    @property
+    def succeeded(self):
+        return self.state == FINISHED and self.returncode == 0
+
+    def cancel(self, grace=None):
+        '''Drop the job if pending, terminate it if running. Processes still
+        alive after ``grace`` seconds are killed.'''
+        grace = self.pool.grace if grace is None else grace
+        with self._lock:
+            if self.state == PENDING:
+                self.state = CANCELLED
+                return True
+
+            if self.state != RUNNING:
+                return False
+
+            self.state = CANCELLED
+            process = self.process
+
+        try:
+            process.terminate()
+        except OSError:
+            pass
+
+        def kill():
+            if process.poll() is None:
+                try:
+                    process.kill()
+                except OSError:
+                    pass
+
+        timer = threading.Timer(grace, kill)
+        timer.daemon = True
+        timer.start()
+        return True
+
+
+class LaunchPool(object):
+    '''Runs commands with at most ``jobs`` processes at a time.
+
+    Each child's stdout and stderr are read line by line from dedicated
+    threads and passed to ``on_output(job, stream, line)`` and, with a
+    ``log_dir``, written to a rotating log per job. ``on_exit(job)`` is
+    called when a job is done. Callbacks run in the pool's threads.
+    '''
+
+    def __init__(self, jobs=None, on_output=None, on_exit=None, log_dir=None,
+                 log_max_bytes=10 * 2 ** 20, log_backups=3, grace=5.0):
+        from concurrent import futures
+
+        self.jobs = jobs or 4
+        self.on_output = on_output
+        self.on_exit = on_exit
+        self.log_dir = log_dir
+        self.log_max_bytes = log_max_bytes
+        self.log_backups = log_backups
+        self.grace = grace
+
+        self._jobs = []
+        self._futures = []
+        self._lock = threading.Lock()
+        self._executor = futures.ThreadPoolExecutor(max_workers=self.jobs)
+
+    def __repr__(self):
+        return '<%s.%s "%i jobs">' % (
+            __name__,
+            self.__class__.__name__,
+            self.jobs
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        if exception_type is not None:
+            self.cancel()
+        self.close()
+
+    def submit(self, command, name=None, environment=None, base=None,
+               env=None, **kwargs):
+        '''Queue ``command`` and return its Job.
+
+        With an ``environment``, it is resolved against ``base`` when the job
+        starts and given to the child only. Otherwise ``env`` is used as is.
+        Extra keyword arguments go to subprocess.Popen.
+        '''
+        if not isinstance(command, (set, list, tuple)):
+            command = [command]
+
+        with self._lock:
+            job = Job(self, len(self._jobs), command, name=name,
+                      environment=environment, base=base, env=env, **kwargs)
+            self._jobs.append(job)
+            self._futures.append(self._executor.submit(self._run, job))
+
+        return job
+
+    def wait(self, timeout=None):
+        '''Wait for every submitted job and return them in order.'''
+        from concurrent import futures
+
+        with self._lock:
+            pending = list(self._futures)
+        futures.wait(pending, timeout=timeout)
+        return list(self._jobs)
+
+    def cancel(self):
+        for job in list(self._jobs):
+            job.cancel()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _get_log(self, job):
+        if not self.log_dir:
+            return None
+
+        if not os.path.isdir(self.log_dir):
+            try:
+                os.makedirs(self.log_dir)
+            except OSError:
+                if not os.path.isdir(self.log_dir):
+                    raise
+
+        name = re.sub(r'[^\w.-]+', '_', job.name)
+        job.log_path = os.path.join(
+            self.log_dir, '%04i-%s.log' % (job.index, name))
+        handler = logging.handlers.RotatingFileHandler(
+            job.log_path, maxBytes=self.log_max_bytes,
+            backupCount=self.log_backups)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        return handler
+
+    def _emit(self, job, log, stream, line):
+        if log is not None:
+            log.handle(logging.makeLogRecord({'msg': line}))
+
+        if self.on_output is not None:
+            try:
+                self.on_output(job, stream, line)
+            except Exception:
+                logger.debug(traceback.format_exc())
+
+    def _pump(self, job, log, stream, pipe):
+        try:
+            for line in iter(pipe.readline, b''):
+                line = line.decode('utf-8', 'replace').rstrip('\r\n')
+                self._emit(job, log, stream, line)
+        finally:
+            pipe.close()
+
+    def _start(self, job):
+        env = job.env
+        if job.environment is not None:
+            env = job.environment.resolve_environ(
+                base=job.base, store_previous=True)
+            job.environment.commit_snapshot(env)
+
+        kwargs = dict(job.kwargs)
+        if 'stdin' not in kwargs:
+            kwargs['stdin'] = open(os.devnull, 'rb')
+        kwargs['stdout'] = subprocess.PIPE
+        kwargs['stderr'] = subprocess.PIPE
+
+        try:
+            return subprocess.Popen(job.command, env=env, **kwargs)
+        finally:
+            if kwargs['stdin'] is not job.kwargs.get('stdin'):
+                kwargs['stdin'].close()
+
+    def _run(self, job):
+        log = None
+        try:
+            with job._lock:
+                if job.state != PENDING:
+                    return job
+
+                log = self._get_log(job)
+                job.started = time.time()
+                try:
+                    job.process = self._start(job)
+                except Exception as e:
+                    job.state = FAILED
+                    job.error = str(e)
+                    logger.warn('Could not start "%s": %s' % (job.name, e))
+                    logger.debug(traceback.format_exc())
+                    return job
+
+                job.state = RUNNING
+
+            readers = [
+                threading.Thread(
+                    target=self._pump,
+                    args=(job, log, 'stdout', job.process.stdout)),
+                threading.Thread(
+                    target=self._pump,
+                    args=(job, log, 'stderr', job.process.stderr)),
+            ]
+            for reader in readers:
+                reader.daemon = True
+                reader.start()
+
+            job.returncode = job.process.wait()
+            for reader in readers:
+                reader.join()
+
+            with job._lock:
+                if job.state == RUNNING:
+                    job.state = FINISHED
+
+        except Exception as e:
+            job.state = FAILED
+            job.error = str(e)
+            logger.warn('Job "%s" failed: %s' % (job.name, e))
+            logger.debug(traceback.format_exc())
+
+        finally:
+            if job.started is not None:
+                job.finished = time.time()
+            if log is not None:
+                log.close()
+
+            if self.on_exit is not None and job.done:
+                try:
+                    self.on_exit(job)
+                except Exception:
+                    logger.debug(traceback.format_exc())
+
+        return job
@@ -1,8 +1,13 @@
 import os
 import logging
+import threading
+import collections
 import traceback
 
 from ecosystem import errors
+from ecosystem import graph
+from ecosystem import handlers
+from ecosystem import trace
 from ecosystem import utils
 
 logger = logging.getLogger(__name__)
@@ -15,90 +20,300 @@ class PresetManager(object):
 
         self.ecosystem = ecosystem
         self._presets = {}
+        self._expanded = {}
+        # Registry scope of the presets, None while they are held in memory.
+        self._scope = None
+        self._lock = threading.RLock()
         self.discover()
-        self.expand_presets()
 
+    @trace.traced('PresetManager.discover')
     def discover(self):
-        for path in self.search_paths:
+        with self._lock:
+            self._discover()
+
+    def _discover(self):
+        self._scope = None
+        if self.ecosystem.registry is not None:
+            self._discover_registry()
+            return
+
+        bundle = self.ecosystem.get_bundle('presets', self.search_paths)
+        if bundle is not None:
+            with trace.span('bundle', path=bundle.path):
+                preset_files, expanded = bundle.presets()
+            self._load(preset_files, expanded)
+            return
+
+        files = self.ecosystem.filehandler.collect(self.search_paths)
+        results = self.ecosystem.filehandler.read_files(
+            files, 'read_preset', workers=self.ecosystem.discover_workers,
+            executor=self.ecosystem.discover_executor
+        )
 
-            if not os.path.isdir(path):
-                logger.debug('Path %s is not a directory. Skipping.' % path)
+        preset_files = collections.OrderedDict()
+        for (preset_path, handler), (presets, error) in zip(files, results):
+            if error is not None:
+                logger.warn('Could not read "%s": %s' % (preset_path, error))
                 continue
 
-            for preset in os.listdir(path):
-                preset_path = os.path.join(path, preset)
+            preset_files[preset_path] = self._parse_presets(
+                presets, preset_path)
 
-                if not os.path.isfile(preset_path):
-                    continue
+        self._load(preset_files)
 
-                ext = os.path.splitext(preset)[-1]
-                handler = self.ecosystem.filehandler.file_handlers.get(ext)
+    def _load(self, preset_files, expanded=None):
+        self._preset_files = preset_files
+        self._presets = {}
+        self._expanded = dict(expanded or {})
+
+        for preset_path, preset_objects in preset_files.items():
+            for preset_object in preset_objects:
+                if preset_object['name'] in self._presets:
+                    logger.warn(
+                        'Overriding preset "%s" with file "%s"' % (
+                            preset_object['name'], preset_path
+                        )
+                    )
 
-                if not handler:
-                    continue
+                self._presets[preset_object['name']] = self._new_preset(
+                    preset_object)
 
-                try:
-                    presets = handler.read_preset(preset_path)
-                except Exception as e:
-                    logger.warn('Could not read "%s": %s' % (preset_path, e))
-                    logger.debug(traceback.format_exc())
-                    continue
+    def _discover_registry(self):
+        from ecosystem import registry
 
-                for preset in presets:
-                    try:
-                        preset_object = {
-                            'name': preset['name'],
-                            'tools': preset['tools'],
-                            'default_command': preset.get('default_command')
-                        }
-                    except (IndexError, KeyError) as e:
-                        logger.warn(
-                            'Unable to load preset "%s": %s' % (preset_path, e)
-                        )
-                        logger.debug(traceback.format_exc())
-                        continue
-
-                    if preset_object['name'] in self._presets:
-                        logger.warn(
-                            'Overriding preset "%s" with file "%s"' % (
-                                preset_object['name'], preset_path
-                            )
-                        )
+        self._scope = 'presets:%s' % os.pathsep.join(self.search_paths)
+        self._preset_files = collections.OrderedDict()
+        self._expanded = {}
+        self._presets = registry.PresetView(
+            self.ecosystem.registry, self._scope, self._new_preset)
+
+        files = self.ecosystem.filehandler.collect(self.search_paths)
+        outdated, removed = self.ecosystem.registry.outdated(
+            self._scope, files, stat=self.ecosystem.filehandler.stat)
+        self.ecosystem.registry.remove_files(self._scope, removed)
+
+        seqs = dict((x[0], i) for i, x in enumerate(files))
+        for path, stat, presets in self._read(outdated):
+            if presets is None:
+                self.ecosystem.registry.remove_files(self._scope, [path])
+                continue
+
+            self.ecosystem.registry.set_presets(
+                self._scope, path, presets, stat=stat, seq=seqs[path])
+
+    def _read(self, files):
+        '''(path, stat, parsed presets or None) of preset files, given as
+        (path, handler, stat).'''
+        results = self.ecosystem.filehandler.read_files(
+            [x[:2] for x in files], 'read_preset',
+            workers=self.ecosystem.discover_workers,
+            executor=self.ecosystem.discover_executor
+        )
 
-                    _preset = Preset(self.ecosystem, **preset_object)
-                    self._presets[preset_object['name']] = _preset
+        read = []
+        for (path, handler, stat), (presets, error) in zip(files, results):
+            if error is not None:
+                logger.warn('Could not read "%s": %s' % (path, error))
+                read.append((path, stat, None))
+                continue
+
+            read.append((path, stat, self._parse_presets(presets, path)))
+
+        return read
+
+    def _parse_presets(self, presets, preset_path):
+        preset_objects = []
+        for preset in presets:
+            try:
+                preset_objects.append({
+                    'name': preset['name'],
+                    'tools': list(preset['tools']),
+                    'default_command': preset.get('default_command')
+                })
+            except (IndexError, KeyError, TypeError) as e:
+                logger.warn(
+                    'Unable to load preset "%s": %s' % (preset_path, e)
+                )
+                logger.debug(traceback.format_exc())
+
+        return preset_objects
+
+    def _new_preset(self, preset_object):
+        return Preset(self.ecosystem, manager=self, **preset_object)
+
+    def update_files(self, paths=None):
+        '''Re-read changed preset files and return the names of the presets
+        that changed, including the ones that include them.'''
+        with self._lock:
+            return self._update_files(paths)
+
+    def _update_files(self, paths):
+        if self._scope is not None:
+            return self._update_registry(paths)
+
+        filehandler = self.ecosystem.filehandler
+        if paths is None:
+            paths = set(self._preset_files)
+            paths.update(x[0] for x in filehandler.collect(self.search_paths))
+
+        files = []
+        for path in paths:
+            handler = filehandler.file_handlers.get(os.path.splitext(path)[-1])
+            if handler and os.path.isfile(path):
+                files.append((path, handler))
+            else:
+                self._preset_files.pop(path, None)
+
+        results = filehandler.read_files(files, 'read_preset')
+        for (path, handler), (presets, error) in zip(files, results):
+            if error is not None:
+                logger.warn('Could not read "%s": %s' % (path, error))
+                continue
 
-    def expand_presets(self):
-        sorted_presets = []
+            self._preset_files[path] = self._parse_presets(presets, path)
 
-        for preset in self._presets.values():
-            index = 0
-            dependencies = preset.subpresets()
-            for i, _preset in reversed(list(enumerate(sorted_presets))):
-                if _preset.name in dependencies:
-                    index = max(sorted_presets.index(_preset) + 1, index)
+        # Files keep the rank fresh discovery would give them, so a new file
+        # only overrides the files listed before it.
+        self._preset_files = collections.OrderedDict(
+            (x, self._preset_files[x]) for x in handlers.discovery_order(
+                self._preset_files, self.search_paths))
 
-            sorted_presets.insert(index, preset)
+        previous = self._presets
+        _presets = {}
+        for preset_objects in self._preset_files.values():
+            for preset_object in preset_objects:
+                _presets[preset_object['name']] = self._new_preset(
+                    preset_object)
 
-        for preset in sorted_presets:
-            for dep in preset.subpresets():
-                dep_preset = self._presets.get(dep)
+        changed = set(
+            x for x in set(previous) | set(_presets)
+            if _definition(previous.get(x)) != _definition(_presets.get(x))
+        )
 
-                if not dep_preset:
-                    logger.warn('Could not find dependency preset "{}" for '
-                                'preset "{}"'.format(dep, preset.name))
+        # Presets including a changed one change too.
+        included_by = {}
+        for preset in _presets.values():
+            for subpreset in preset.subpresets():
+                included_by.setdefault(subpreset, []).append(preset.name)
+
+        stack = list(changed)
+        while stack:
+            for name in included_by.get(stack.pop(), ()):
+                if name not in changed:
+                    changed.add(name)
+                    stack.append(name)
+
+        self._presets = _presets
+        for name in changed:
+            self._expanded.pop(name, None)
+
+        return changed
+
+    def _update_registry(self, paths):
+        registry = self.ecosystem.registry
+        filehandler = self.ecosystem.filehandler
+        known = set(registry.paths(self._scope))
+        if paths is None:
+            paths = set(known)
+            paths.update(x[0] for x in filehandler.collect(self.search_paths))
+
+        files = []
+        removed = []
+        for path in paths:
+            handler = filehandler.file_handlers.get(os.path.splitext(path)[-1])
+            if handler and os.path.isfile(path):
+                files.append((path, handler, os.stat(path)))
+            elif path in known:
+                removed.append(path)
+
+        # Files that cannot be read keep what they defined so far.
+        read = [x for x in self._read(files) if x[2] is not None]
+        names = registry.names_in(
+            self._scope, removed + [x[0] for x in read], 'presets')
+        names.update(y['name'] for x in read for y in x[2])
+        previous = dict((x, _definition(self._presets.get(x))) for x in names)
+
+        order = handlers.discovery_order(
+            [x for x in registry.paths(self._scope) if x not in removed] +
+            [x[0] for x in read if x[0] not in known], self.search_paths)
+        seqs = dict((x, i) for i, x in enumerate(order))
+
+        registry.remove_files(self._scope, removed)
+        registry.reorder(self._scope, order)
+        for path, stat, presets in read:
+            registry.set_presets(
+                self._scope, path, presets, stat=stat, seq=seqs[path])
+        self._presets.invalidate(names)
+
+        changed = set(
+            x for x in names
+            if _definition(self._presets.get(x)) != previous[x]
+        )
+
+        # Presets including a changed one change too.
+        stack = list(changed)
+        while stack:
+            for name in registry.including(self._scope, stack.pop()):
+                if name not in changed:
+                    changed.add(name)
+                    stack.append(name)
+
+        for name in changed:
+            self._expanded.pop(name, None)
+
+        return changed
+
+    def _expand(self, names):
+        # Presets reachable from names and not expanded yet, so each one is
+        # expanded once, after the presets it includes.
+        with trace.span('PresetManager.expand', presets=list(names)):
+            edges = {}
+            stack = list(names)
+            while stack:
+                name = stack.pop()
+                if name in edges or name in self._expanded:
                     continue
 
-                idx = preset.subpreset_index(dep)
-                if idx is None:
-                    logger.warn('Dependency "{}" of preset "{}" is not of '
-                                'format "preset:presetName"'
-                                .format(dep, preset.name))
+                preset = self._presets.get(name)
+                if preset is None:
                     continue
 
-                preset.tools.pop(idx)
-                for tool in reversed(dep_preset.tools):
-                    preset.tools.insert(idx, tool)
+                edges[name] = preset.subpresets()
+                stack.extend(edges[name])
+
+            for name in graph.toposort(sorted(edges), edges, label='preset'):
+                self._expanded[name] = tuple(
+                    self._inline(self._presets[name]))
+
+    def _inline(self, preset):
+        tools = []
+        for tool in preset.raw_tools:
+            subpreset = _subpreset(tool)
+            if subpreset is None:
+                tools.append(tool)
+            elif subpreset in self._expanded:
+                tools.extend(self._expanded[subpreset])
+            else:
+                logger.warn('Could not find dependency preset "{}" for '
+                            'preset "{}"'.format(subpreset, preset.name))
+                tools.append(tool)
+
+        return tools
+
+    def expand(self, preset):
+        '''Return the tools of a preset with included presets inlined.
+
+        Expanded tool lists are memoized, and only the presets reachable from
+        the requested one are expanded. Raises CyclicDependencyError when
+        presets include each other.
+        '''
+        with self._lock:
+            if self._presets.get(preset.name) is preset:
+                self._expand([preset.name])
+                return list(self._expanded[preset.name])
+
+            self._expand(preset.subpresets())
+            return self._inline(preset)
 
     def get_preset(self, name):
         preset = self._presets.get(name)
@@ -109,16 +324,37 @@ class PresetManager(object):
 
         return preset
 
+    def preset_files(self):
+        '''The parsed presets of each file, in discovery order.'''
+        with self._lock:
+            if self._scope is not None:
+                return self.ecosystem.registry.preset_files(self._scope)
+            return collections.OrderedDict(self._preset_files)
+
     def list_presets(self):
         return sorted(self._presets.keys())
 
 
+def _definition(preset):
+    if preset is None:
+        return None
+    return (preset.raw_tools, preset.default_command)
+
+
+def _subpreset(tool):
+    if tool.startswith('preset:'):
+        return tool.split(':')[-1]
+    return None
+
+
 class Preset(object):
-    def __init__(self, ecosystem, name, tools, default_command):
+    def __init__(self, ecosystem, name, tools, default_command,
+                 manager=None):
         self.ecosystem = ecosystem
         self.name = name
-        self.tools = tools
+        self.raw_tools = list(tools)
         self.default_command = default_command
+        self.manager = manager
 
     def __repr__(self):
         return '<%s.%s "%s">' % (
@@ -127,20 +363,32 @@ class Preset(object):
             self.name
         )
 
+    @property
+    def tools(self):
+        manager = self.manager or self.ecosystem.presetmanager
+        return manager.expand(self)
+
     def subpreset_index(self, preset):
-        for i, tool in enumerate(self.tools):
-            if tool.startswith('preset:{}'.format(preset)):
+        for i, tool in enumerate(self.raw_tools):
+            if _subpreset(tool) == preset:
                 return i
 
     def subpresets(self):
         subp = []
-        for tool in self.tools:
-            if tool.startswith('preset:'):
-                subp.append(tool.split(':')[-1])
+        for tool in self.raw_tools:
+            subpreset = _subpreset(tool)
+            if subpreset is not None:
+                subp.append(subpreset)
 
         return subp
 
-    def run(self, command=None, detached=True):
+    def run(self, command=None, detached=True, pool=None, base=None):
+        '''Run the command, or the default one, in the preset environment.
+
+        With a pool.LaunchPool, the command is queued there and its Job is
+        returned, with its output streamed to the pool. Otherwise a detached
+        child writes to our stdout and stderr, and its Popen is returned.
+        '''
         environment = self.get_environment()
         command = command or self.default_command
 
@@ -150,15 +398,15 @@ class Preset(object):
         if not isinstance(command, (set, list, tuple)):
             command = [command]
 
-        command = map(str, command)
-
-        with environment:
-            envs = environment.environ
+        command = [str(x) for x in command]
 
-        for key, val in envs.items():
-            envs[str(key)] = str(val)
+        if pool is not None:
+            return pool.submit(
+                command, name=self.name, environment=environment, base=base)
 
-        return utils.call_process(command, detached=detached, env=envs)
+        return utils.call_process(
+            command, detached=detached, environment=environment,
+            env=base)
 
     def get_environment(self):
         env = self.ecosystem.get_environment(*self.tools)
@@ -0,0 +1,478 @@
+import os
+import json
+import collections
+import time
+import sqlite3
+import logging
+import threading
+
+from ecosystem import tool as ecotool
+from ecosystem import versions as ecoversions
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    scope TEXT NOT NULL,
+    path TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    mtime REAL,
+    size INTEGER,
+    loaded REAL,
+    PRIMARY KEY (scope, path)
+);
+CREATE TABLE IF NOT EXISTS tools (
+    scope TEXT NOT NULL,
+    name TEXT NOT NULL,
+    family TEXT NOT NULL,
+    version TEXT NOT NULL,
+    source TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    platforms TEXT NOT NULL,
+    requires TEXT NOT NULL,
+    environment TEXT NOT NULL,
+    optional TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tools_name ON tools (scope, name);
+CREATE INDEX IF NOT EXISTS tools_family ON tools (scope, family, version);
+CREATE INDEX IF NOT EXISTS tools_source ON tools (scope, source);
+CREATE TABLE IF NOT EXISTS requirements (
+    scope TEXT NOT NULL,
+    name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    family TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS requirements_family ON requirements (scope, family);
+CREATE INDEX IF NOT EXISTS requirements_source ON requirements (scope, source);
+CREATE TABLE IF NOT EXISTS presets (
+    scope TEXT NOT NULL,
+    name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    tools TEXT NOT NULL,
+    default_command TEXT
+);
+CREATE INDEX IF NOT EXISTS presets_name ON presets (scope, name);
+CREATE INDEX IF NOT EXISTS presets_source ON presets (scope, source);
+'''
+
+# The definition of a name is the last one, in the last file defining it.
+_WINNER = '''
+    FROM %s AS x JOIN files AS f ON f.scope = x.scope AND f.path = x.source
+    WHERE x.scope = ? AND x.name = ?
+    ORDER BY f.seq DESC, x.position DESC LIMIT 1
+'''
+
+
+def _dumps(data):
+    return json.dumps(data, separators=(',', ':'))
+
+
+class Registry(object):
+    '''Tools and presets indexed in a SQLite database.
+
+    Each set of search paths is a scope. Discovery only reads the files that
+    changed since they were recorded, and lookups are indexed queries, so
+    nothing is loaded in memory until it is used.
+    '''
+
+    # Files read this soon after they were modified are read again, see
+    # DiscoveryCache.racy_interval.
+    racy_interval = 2.0
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._connection = sqlite3.connect(
+            path, timeout=30, check_same_thread=False)
+        self._create()
+
+    def __repr__(self):
+        return '<%s.%s "%s">' % (
+            __name__,
+            self.__class__.__name__,
+            self.path
+        )
+
+    def _create(self):
+        with self._lock:
+            if self._version() == SCHEMA_VERSION:
+                return
+
+            # Processes opening a new registry at once all get here: the
+            # schema is created by the first one to take the lock.
+            connection = self._connection
+            isolation_level = connection.isolation_level
+            connection.isolation_level = None
+            try:
+                connection.execute('BEGIN EXCLUSIVE')
+                try:
+                    self._create_schema(connection)
+                except BaseException:
+                    connection.execute('ROLLBACK')
+                    raise
+                connection.execute('COMMIT')
+            finally:
+                connection.isolation_level = isolation_level
+
+    def _version(self):
+        return self._connection.execute('PRAGMA user_version').fetchone()[0]
+
+    def _create_schema(self, connection):
+        version = self._version()
+        if version == SCHEMA_VERSION:
+            return
+
+        if version:
+            logger.debug('Recreating registry "%s" (schema %i)' % (
+                self.path, version))
+            for table in ('files', 'tools', 'requirements', 'presets'):
+                connection.execute('DROP TABLE IF EXISTS %s' % table)
+
+        for statement in SCHEMA.split(';'):
+            if statement.strip():
+                connection.execute(statement)
+        connection.execute('PRAGMA user_version = %i' % SCHEMA_VERSION)
+
+    def query(self, sql, *args):
+        with self._lock:
+            return self._connection.execute(sql, args).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def paths(self, scope):
+        return [x[0] for x in self.query(
+            'SELECT path FROM files WHERE scope = ? ORDER BY seq', scope)]
+
+    def outdated(self, scope, files, stat=os.stat):
+        '''Record the order of files, (path, handler) pairs, and return the
+        (path, handler, stat) of those that changed since they were read,
+        and the recorded paths that are gone. Files are stat-ed with
+        ``stat``.'''
+        _stat = stat
+        recorded = dict(
+            (x[0], x[1:]) for x in self.query(
+                'SELECT path, mtime, size, loaded, seq FROM files '
+                'WHERE scope = ?', scope)
+        )
+
+        now = time.time()
+        outdated = []
+        moved = []
+        for seq, (path, handler) in enumerate(files):
+            record = recorded.pop(path, None)
+            if record is not None and record[3] != seq:
+                moved.append((seq, scope, path))
+
+            try:
+                stat = _stat(path)
+            except OSError:
+                stat = None
+
+            if record is None or stat is None or not handler.cacheable or \
+                    (stat.st_mtime, stat.st_size) != tuple(record[:2]) or \
+                    record[2] - stat.st_mtime < self.racy_interval or (
+                        handler.cache_ttl is not None and
+                        now - record[2] >= handler.cache_ttl):
+                outdated.append((path, handler, stat))
+
+        if moved:
+            with self._lock, self._connection as connection:
+                connection.executemany(
+                    'UPDATE files SET seq = ? WHERE scope = ? AND path = ?',
+                    moved)
+
+        return outdated, list(recorded)
+
+    def reorder(self, scope, paths):
+        '''Record paths, in this order, as the discovery order of their
+        files.'''
+        recorded = dict(self.query(
+            'SELECT path, seq FROM files WHERE scope = ?', scope))
+        moved = [
+            (seq, scope, path) for seq, path in enumerate(paths)
+            if recorded.get(path, seq) != seq
+        ]
+        if moved:
+            with self._lock, self._connection as connection:
+                connection.executemany(
+                    'UPDATE files SET seq = ? WHERE scope = ? AND path = ?',
+                    moved)
+
+    def _replace_file(self, connection, scope, path, stat, seq):
+        if seq is None:
+            row = connection.execute(
+                'SELECT seq FROM files WHERE scope = ? AND path = ?',
+                (scope, path)).fetchone() or connection.execute(
+                'SELECT COALESCE(MAX(seq), -1) + 1 FROM files '
+                'WHERE scope = ?', (scope,)).fetchone()
+            seq = row[0]
+
+        connection.execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+            (scope, path, seq,
+             stat.st_mtime if stat else None, stat.st_size if stat else None,
+             time.time()))
+
+    def _names(self, connection, table, scope, path):
+        return set(x[0] for x in connection.execute(
+            'SELECT name FROM %s WHERE scope = ? AND source = ?' % table,
+            (scope, path)))
+
+    def set_tools(self, scope, path, entries, stat=None, seq=None):
+        '''Replace the tools defined by path and return the names defined
+        before and after. New files come last unless seq is given.'''
+        with self._lock, self._connection as connection:
+            names = self._names(connection, 'tools', scope, path)
+            connection.execute(
+                'DELETE FROM tools WHERE scope = ? AND source = ?',
+                (scope, path))
+            connection.execute(
+                'DELETE FROM requirements WHERE scope = ? AND source = ?',
+                (scope, path))
+
+            connection.executemany(
+                'INSERT INTO tools VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(scope, x.name, x.tool, x.version, path, i,
+                  _dumps(x.platforms), _dumps(x.requires),
+                  _dumps(x.environment), _dumps(x.optional))
+                 for i, x in enumerate(entries)])
+            connection.executemany(
+                'INSERT INTO requirements VALUES (?, ?, ?, ?)',
+                [(scope, x.name, path,
+                  (ecoversions.parse_requirement(y) or (y.strip(),))[0])
+                 for x in entries for y in x.requires])
+
+            self._replace_file(connection, scope, path, stat, seq)
+            return names | set(x.name for x in entries)
+
+    def set_presets(self, scope, path, presets, stat=None, seq=None):
+        '''Replace the presets defined by path, dicts as parsed by the
+        PresetManager, and return the names defined before and after.'''
+        with self._lock, self._connection as connection:
+            names = self._names(connection, 'presets', scope, path)
+            connection.execute(
+                'DELETE FROM presets WHERE scope = ? AND source = ?',
+                (scope, path))
+            connection.executemany(
+                'INSERT INTO presets VALUES (?, ?, ?, ?, ?, ?)',
+                [(scope, x['name'], path, i, _dumps(x['tools']),
+                  _dumps(x['default_command']))
+                 for i, x in enumerate(presets)])
+
+            self._replace_file(connection, scope, path, stat, seq)
+            return names | set(x['name'] for x in presets)
+
+    def remove_files(self, scope, paths):
+        '''Forget paths, returning the names of the tools and presets they
+        defined.'''
+        names = set()
+        with self._lock, self._connection as connection:
+            for path in paths:
+                for table in ('tools', 'presets'):
+                    names.update(self._names(connection, table, scope, path))
+                    connection.execute(
+                        'DELETE FROM %s WHERE scope = ? AND source = ?' %
+                        table, (scope, path))
+                connection.execute(
+                    'DELETE FROM requirements WHERE scope = ? AND source = ?',
+                    (scope, path))
+                connection.execute(
+                    'DELETE FROM files WHERE scope = ? AND path = ?',
+                    (scope, path))
+        return names
+
+    def names_in(self, scope, paths, table='tools'):
+        '''Names of the tools or presets defined by paths.'''
+        names = set()
+        with self._lock:
+            for path in paths:
+                names.update(
+                    self._names(self._connection, table, scope, path))
+        return names
+
+    def get_tool(self, scope, name):
+        rows = self.query(
+            'SELECT x.family, x.version, x.platforms, x.requires, '
+            'x.environment, x.optional, x.source' + _WINNER % 'tools',
+            scope, name)
+        if not rows:
+            return None
+
+        tool, version, platforms, requires, environment, optional, source = \
+            rows[0]
+        return ecotool.ToolEntry(
+            tool=tool,
+            version=version,
+            platforms=json.loads(platforms),
+            requires=json.loads(requires),
+            environment=json.loads(environment),
+            optional=json.loads(optional),
+            source=source
+        )
+
+    def get_preset(self, scope, name):
+        rows = self.query(
+            'SELECT x.tools, x.default_command' + _WINNER % 'presets',
+            scope, name)
+        if not rows:
+            return None
+
+        return {
+            'name': name,
+            'tools': json.loads(rows[0][0]),
+            'default_command': json.loads(rows[0][1]),
+        }
+
+    def preset_files(self, scope):
+        '''Presets defined by each file, in discovery order, as parsed by the
+        PresetManager.'''
+        files = collections.OrderedDict()
+        for path, name, tools, default_command in self.query(
+                'SELECT f.path, x.name, x.tools, x.default_command '
+                'FROM files f LEFT JOIN presets x '
+                'ON x.scope = f.scope AND x.source = f.path '
+                'WHERE f.scope = ? ORDER BY f.seq, x.position', scope):
+            presets = files.setdefault(path, [])
+            if name is not None:
+                presets.append({
+                    'name': name,
+                    'tools': json.loads(tools),
+                    'default_command': json.loads(default_command),
+                })
+        return files
+
+    def names(self, scope, table='tools'):
+        return [x[0] for x in self.query(
+            'SELECT DISTINCT name FROM %s WHERE scope = ?' % table, scope)]
+
+    def families(self, scope):
+        return [x[0] for x in self.query(
+            'SELECT DISTINCT family FROM tools WHERE scope = ?', scope)]
+
+    def versions(self, scope, family):
+        return self.query(
+            'SELECT DISTINCT version, name FROM tools '
+            'WHERE scope = ? AND family = ?', scope, family)
+
+    def required_by(self, scope, family):
+        '''Names of the tools requiring any version of family.'''
+        return sorted(set(x[0] for x in self.query(
+            'SELECT name FROM requirements WHERE scope = ? AND family = ?',
+            scope, family)))
+
+    def including(self, scope, preset):
+        '''Names of the presets including preset.'''
+        return sorted(set(x[0] for x in self.query(
+            'SELECT name FROM presets WHERE scope = ? AND tools LIKE ?',
+            scope, '%%"preset:%s"%%' % preset)))
+
+
+class ToolView(object):
+    '''Read-only mapping of the tools of a scope, by name.'''
+
+    def __init__(self, registry, scope):
+        self.registry = registry
+        self.scope = scope
+
+    def get(self, name, default=None):
+        entry = self.registry.get_tool(self.scope, name)
+        return default if entry is None else entry
+
+    def __getitem__(self, name):
+        entry = self.registry.get_tool(self.scope, name)
+        if entry is None:
+            raise KeyError(name)
+        return entry
+
+    def __contains__(self, name):
+        return self.registry.get_tool(self.scope, name) is not None
+
+    def keys(self):
+        return self.registry.names(self.scope)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[x] for x in self.keys()]
+
+    def items(self):
+        return [(x, self[x]) for x in self.keys()]
+
+    def copy(self):
+        return self
+
+
+class PresetView(ToolView):
+    '''Read-only mapping of the presets of a scope, by name. Preset objects
+    are created by factory and kept until invalidated.'''
+
+    def __init__(self, registry, scope, factory):
+        super(PresetView, self).__init__(registry, scope)
+        self.factory = factory
+        self._objects = {}
+
+    def get(self, name, default=None):
+        preset = self._objects.get(name)
+        if preset is None:
+            data = self.registry.get_preset(self.scope, name)
+            if data is None:
+                return default
+            preset = self._objects.setdefault(name, self.factory(data))
+        return preset
+
+    def __getitem__(self, name):
+        preset = self.get(name)
+        if preset is None:
+            raise KeyError(name)
+        return preset
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def keys(self):
+        return self.registry.names(self.scope, 'presets')
+
+    def invalidate(self, names=None):
+        if names is None:
+            self._objects = {}
+        for name in names or ():
+            self._objects.pop(name, None)
+
+
+class RegistryVersionIndex(ecoversions.VersionIndex):
+    '''VersionIndex loading the versions of a family on first use.'''
+
+    def __init__(self, registry, scope):
+        super(RegistryVersionIndex, self).__init__()
+        self.registry = registry
+        self.scope = scope
+        self._lock = threading.Lock()
+
+    def _family(self, tool):
+        family = self._families.get(tool)
+        if family is None:
+            with self._lock:
+                family = self._families.get(tool)
+                if family is None:
+                    for version, name in self.registry.versions(
+                            self.scope, tool):
+                        self.add(tool, version, name)
+                    family = self._families.setdefault(tool, ([], []))
+        return family
+
+    def tools(self):
+        return sorted(self.registry.families(self.scope))
@@ -0,0 +1,200 @@
+import os
+import re
+import collections
+
+from ecosystem import errors
+from ecosystem import graph
+
+# ${VAR}, $VAR and %VAR% references, in a single pass.
+reference_regex = re.compile(r'\$\{(\w+)\}|\$(\w+)|%(\w+)%')
+
+modes = ('append', 'prepend', 'expand', 'default')
+
+# Path list options a variable can enable next to its mode.
+path_options = ('normalize', 'dedupe', 'prune')
+
+
+def merge_paths(values, normalize=False, dedupe=False, prune=False,
+                exists=os.path.exists):
+    '''Entries of os.pathsep separated values in one linear pass, keeping
+    their order.
+
+    ``normalize`` applies os.path.normpath to every entry, ``dedupe`` keeps
+    the first of the entries equal once normalized and ``prune`` drops the
+    entries ``exists`` rejects.
+    '''
+    merged = []
+    seen = set()
+    for value in values:
+        for entry in value.split(os.pathsep):
+            if not entry:
+                continue
+
+            if normalize:
+                entry = os.path.normpath(entry)
+
+            if dedupe:
+                key = os.path.normcase(
+                    entry if normalize else os.path.normpath(entry))
+                if key in seen:
+                    continue
+                seen.add(key)
+
+            if prune and not exists(entry):
+                continue
+
+            merged.append(entry)
+
+    return merged
+
+
+class Resolver(object):
+    '''Resolves tool variables against one base environment.
+
+    Expanded values are memoized per variable key, keyed by the variables
+    contributing to it and the values of its dependencies, so resolving many
+    tool sets against the same base only expands shared keys once.
+    '''
+
+    def __init__(self, base, normalize_paths=False):
+        self.base = base
+        self.normalize_paths = normalize_paths
+        self.base_keys = dict((x.upper(), x) for x in base)
+        self._values = {}
+        self._exists = {}
+
+    def __repr__(self):
+        return '<%s.%s>' % (__name__, self.__class__.__name__)
+
+    def _base_value(self, name):
+        value = self.base.get(name)
+        if value is None:
+            value = self.base.get(self.base_keys.get(name.upper()))
+        return value
+
+    def _path_exists(self, path):
+        exists = self._exists.get(path)
+        if exists is None:
+            exists = self._exists[path] = os.path.exists(path)
+        return exists
+
+    def resolve(self, variables):
+        '''Return a dict with the final value of every variable key.
+
+        Each value is expanded exactly once, after the values it references.
+        '''
+        for variable in variables:
+            if variable.mode() not in modes:
+                raise ValueError('Variable "{}" has an unsupported mode "{}"'
+                                 .format(variable.key, variable.mode()))
+
+        layers, edges, external = variable_graph(variables)
+        for variable, dependency in external:
+            if self._base_value(dependency) is None:
+                raise errors.MissingDependencyError(
+                    'Variable "%s" of tool "%s" cannot be resolved: '
+                    'Environment "%s" is missing' % (
+                        variable.key,
+                        variable.tool.name,
+                        dependency
+                    )
+                )
+
+        defined = dict((x.upper(), x) for x in layers)
+        order = graph.toposort(layers, edges, label='variable')
+
+        resolved = {}
+        for key in order:
+            memo_key = (key, tuple(layers[key]), tuple(
+                (x, resolved[x]) for x in edges[key]))
+
+            value = self._values.get(memo_key)
+            if value is None:
+                value = self._values[memo_key] = self._expand(
+                    key, layers, defined, resolved)
+
+            resolved[key] = value
+
+        return resolved
+
+    def _expand(self, key, layers, defined, resolved):
+        def replace(match):
+            name = match.group(1) or match.group(2) or match.group(3)
+            target = name if name in layers else defined.get(name.upper())
+            if target is not None and target != key:
+                return resolved[target]
+
+            value = self._base_value(name)
+            return match.group(0) if value is None else value
+
+        present = key in self.base
+        entries = [x for x in self.base.get(key, '').split(os.pathsep) if x]
+        # Prepended values in reverse, so each value is added in O(1).
+        prepended = []
+        options = set()
+
+        for variable in layers[key]:
+            value = reference_regex.sub(replace, variable.value)
+            mode = variable.mode()
+            options.update(variable.path_options())
+
+            if mode == 'append':
+                if value:
+                    entries.append(value)
+            elif mode == 'prepend':
+                if value:
+                    prepended.append(value)
+            elif mode == 'expand':
+                entries = [value]
+                prepended = []
+            elif mode == 'default' and not present:
+                entries = [value]
+                prepended = []
+
+            present = True
+
+        prepended.reverse()
+        entries = prepended + entries
+
+        if self.normalize_paths or options:
+            entries = merge_paths(
+                entries,
+                normalize=self.normalize_paths or 'normalize' in options,
+                dedupe='dedupe' in options,
+                prune='prune' in options,
+                exists=self._path_exists
+            )
+
+        return str(os.pathsep.join(entries))
+
+
+def variable_graph(variables):
+    '''Variables grouped by key, in order, the keys each key references
+    among them, and the (variable, name) references to other names.'''
+    layers = collections.OrderedDict()
+    for variable in variables:
+        layers.setdefault(variable.key, []).append(variable)
+
+    defined = dict((x.upper(), x) for x in layers)
+
+    edges = {}
+    external = []
+    for key, key_variables in layers.items():
+        dependencies = edges[key] = []
+        for variable in key_variables:
+            for dependency in variable.dependencies:
+                dependency_key = defined.get(dependency)
+                if dependency_key is None:
+                    external.append((variable, dependency))
+                # A variable referencing itself extends the base value.
+                elif dependency_key != key:
+                    dependencies.append(dependency_key)
+
+    return layers, edges, external
+
+
+def sort_variables(variables):
+    '''Variables in the order Resolver expands their keys.'''
+    layers, edges, _ = variable_graph(variables)
+    order = graph.toposort(layers, edges, label='variable')
+    return [x for key in order for x in layers[key]]
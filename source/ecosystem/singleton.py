@@ -4,10 +4,12 @@ import ecosystem
 _singletons = {}
 
 
-def ecosystem_instance(settings='default', recreate=False):
+def ecosystem_instance(settings='default', recreate=False, watch=False):
     global _singletons
 
     if settings in _singletons and not recreate:
+        if watch and not _singletons[settings].watching:
+            _singletons[settings].watch()
         return _singletons[settings]
 
     supported_settings = ['default']
@@ -15,7 +17,13 @@ def ecosystem_instance(settings='default', recreate=False):
         raise ValueError('Supported singleton settings {!r}'
                          .format(supported_settings))
 
+    if settings in _singletons:
+        _singletons[settings].stop_watching()
+
     if settings == 'default':
         _singletons[settings] = ecosystem.Ecosystem()
 
+    if watch:
+        _singletons[settings].watch()
+
     return _singletons[settings]
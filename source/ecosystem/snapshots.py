@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import hashlib
+import getpass
+import logging
+import tempfile
+
+from ecosystem import utils
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotStore(object):
+    '''Content-addressed store of environments for ECO_PREVIOUS_ENV.'''
+
+    prefix = 'ecosystem.snapshot.'
+    suffix = '.json'
+
+    def __init__(self, root=None, max_age=None, max_size=None,
+                 gc_interval=3600):
+        self.root = root or os.getenv('ECO_SNAPSHOT_DIR') or os.path.join(
+            tempfile.gettempdir(), 'ecosystem-%s' % getpass.getuser())
+
+        if max_age is None:
+            max_age = float(os.getenv('ECO_SNAPSHOT_MAX_AGE', 7 * 86400))
+        if max_size is None:
+            max_size = int(os.getenv('ECO_SNAPSHOT_MAX_SIZE', 100 * 2 ** 20))
+
+        self.max_age = max_age
+        self.max_size = max_size
+        self.gc_interval = gc_interval
+
+    def __repr__(self):
+        return '<%s.%s "%s">' % (
+            __name__,
+            self.__class__.__name__,
+            self.root
+        )
+
+    def snapshot(self, environ):
+        data = json.dumps(
+            environ, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha1(data).hexdigest()
+        return Snapshot(self, digest, data)
+
+    def path(self, digest):
+        return os.path.join(self.root, self.prefix + digest + self.suffix)
+
+    def is_snapshot(self, path):
+        name = os.path.basename(path)
+        return name.startswith(self.prefix) and name.endswith(self.suffix)
+
+    def write(self, snapshot):
+        '''Store snapshot and return its path. The root is created with mode
+        0700, and UnsafePathError is raised when it belongs to another user
+        or others can write to it, as snapshots become environments.'''
+        path = snapshot.path
+        utils.private_directory(self.root)
+
+        if os.path.isfile(path):
+            # Already stored: only mark it as recently used for the gc.
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+            return path
+
+        utils.atomic_write(path, snapshot.data)
+
+        self._maybe_gc()
+        return path
+
+    def _maybe_gc(self):
+        marker = os.path.join(self.root, '.gc')
+        try:
+            if time.time() - os.path.getmtime(marker) < self.gc_interval:
+                return
+        except OSError:
+            pass
+
+        try:
+            with open(marker, 'w'):
+                pass
+            self.gc()
+        except (IOError, OSError) as e:
+            logger.debug('Could not collect snapshots: %s' % e)
+
+    def gc(self, max_age=None, max_size=None):
+        max_age = self.max_age if max_age is None else max_age
+        max_size = self.max_size if max_size is None else max_size
+
+        if not os.path.isdir(self.root):
+            return 0
+
+        now = time.time()
+        snapshots = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not self.is_snapshot(path):
+                continue
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            snapshots.append((stat.st_mtime, stat.st_size, path))
+
+        # Oldest first, so size pruning drops the least recently used.
+        snapshots.sort()
+        total = sum(x[1] for x in snapshots)
+
+        removed = 0
+        for mtime, size, path in snapshots:
+            expired = max_age and now - mtime > max_age
+            oversized = max_size and total > max_size
+            if not expired and not oversized:
+                continue
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+            total -= size
+            removed += 1
+
+        if removed:
+            logger.debug('Removed %i snapshots from "%s"' % (
+                removed, self.root))
+        return removed
+
+
+class Snapshot(object):
+    def __init__(self, store, digest, data):
+        self.store = store
+        self.digest = digest
+        self.data = data
+
+    def __repr__(self):
+        return '<%s.%s "%s">' % (
+            __name__,
+            self.__class__.__name__,
+            self.digest
+        )
+
+    @property
+    def path(self):
+        return self.store.path(self.digest)
+
+    def commit(self):
+        return self.store.write(self)
@@ -0,0 +1,205 @@
+import logging
+
+from ecosystem import errors
+from ecosystem import graph
+from ecosystem import versions
+
+logger = logging.getLogger(__name__)
+
+
+def parse_requirement(requirement):
+    '''Split "maya>=2016,<2018" into ("maya", ">=2016,<2018") and "maya"
+    into ("maya", "").'''
+    return versions.parse_requirement(requirement) or (requirement.strip(), '')
+
+
+def _describe(constraints):
+    return ', '.join(
+        '"%s" (required by %s)' % (spec or '*', required_by or 'request')
+        for spec, required_by in constraints
+    )
+
+
+class Solver(object):
+    '''Picks one version per tool family so that every requirement holds.
+
+    Tools are tried newest first and the search backtracks on conflicts.
+    Solutions and dead ends are memoized, so a Solver must be dropped when
+    the tools it was built for change.
+    '''
+
+    def __init__(self, index, entries):
+        self.index = index
+        self.entries = entries
+        self._solutions = {}
+        self._failures = {}
+        self._candidates = {}
+
+    def __repr__(self):
+        return '<%s.%s>' % (__name__, self.__class__.__name__)
+
+    def solve(self, requests):
+        '''Return the tool names satisfying requests, requirements first.
+
+        Requests are exact tool names (always used as is), family names
+        ("mtoa") or ranges ("maya>=2016,<2018").
+        '''
+        key = tuple(requests)
+        solution = self._solutions.get(key)
+        if solution is None:
+            solution = self._solutions[key] = self._solve(requests)
+        return list(solution)
+
+    def _requires(self, name):
+        return self.entries[name].requires
+
+    def _solve(self, requests):
+        pinned = {}
+        constraints = {}
+        queue = []
+        order = []
+
+        for request in requests:
+            entry = self.entries.get(request)
+            if entry is not None:
+                family, name = entry.tool, entry.name
+                version = versions.Version(entry.version)
+                if family in pinned and pinned[family][1] != name:
+                    raise errors.UnsatisfiableRequirementsError(
+                        'Conflicting requests for "%s": %s and %s' % (
+                            family, pinned[family][1], name),
+                        family, [])
+
+                pinned[family] = (version, name)
+                order.append(family)
+                continue
+
+            family, spec = parse_requirement(request)
+            constraints[family] = constraints.get(family, ()) + (
+                (spec, None),)
+            if family not in queue:
+                queue.append(family)
+
+        # Requirements of the tools requested by name.
+        for family in list(order):
+            conflict = self._constrain(
+                pinned[family][1], pinned, constraints, queue)
+            if conflict:
+                raise errors.UnsatisfiableRequirementsError(*conflict)
+
+        for family in queue:
+            if not self._check_pinned(family, pinned, constraints):
+                raise errors.UnsatisfiableRequirementsError(
+                    'Cannot satisfy requirements for "%s": %s, %s was '
+                    'requested' % (family, _describe(constraints[family]),
+                                   pinned[family][1]),
+                    family, constraints[family])
+
+        queue = [x for x in queue if x not in pinned]
+        solution = self._search(pinned, constraints, tuple(queue))
+        return self._sort(solution, order + list(queue))
+
+    def _check_pinned(self, family, pinned, constraints):
+        if family not in pinned:
+            return True
+
+        version = pinned[family][0]
+        specifier = versions.get_specifier(
+            ','.join(x[0] for x in constraints.get(family, ()) if x[0]))
+        return specifier.contains(version, prereleases=True)
+
+    def _constrain(self, name, pinned, constraints, queue):
+        '''Add the requirements of ``name``, returning a conflict, if any.'''
+        for requirement in self._requires(name):
+            family, spec = parse_requirement(requirement)
+            constraints[family] = constraints.get(family, ()) + (
+                (spec, name),)
+
+            if family in pinned:
+                if not self._check_pinned(family, pinned, constraints):
+                    return (
+                        'Cannot satisfy requirements for "%s": %s, %s was '
+                        'picked' % (
+                            family, _describe(constraints[family]),
+                            pinned[family][1]),
+                        family, constraints[family])
+            elif family not in queue:
+                queue.append(family)
+
+        return None
+
+    def _get_candidates(self, family, specs):
+        key = (family, specs)
+        candidates = self._candidates.get(key)
+        if candidates is None:
+            found = self.index.find(family, ','.join(x for x in specs if x))
+            candidates = self._candidates[key] = list(reversed(found))
+        return candidates
+
+    def _search(self, pinned, constraints, queue):
+        if not queue:
+            return pinned
+
+        state = (
+            tuple(sorted(x[1] for x in pinned.values())),
+            tuple(sorted(
+                (x, tuple(sorted(set(y[0] for y in constraints[x]))))
+                for x in queue
+            )),
+        )
+        failure = self._failures.get(state)
+        if failure is not None:
+            raise errors.UnsatisfiableRequirementsError(*failure)
+
+        family = queue[0]
+        specs = tuple(sorted(set(x[0] for x in constraints[family])))
+        candidates = self._get_candidates(family, specs)
+
+        if not candidates:
+            if self.index.find(family, '', prereleases=True):
+                message = 'No version of "%s" matches %s' % (
+                    family, _describe(constraints[family]))
+            else:
+                message = 'Tool "%s" required by %s does not exist' % (
+                    family, ', '.join(sorted(set(
+                        x[1] or 'request' for x in constraints[family]))))
+            failure = (message, family, constraints[family])
+
+        for version, name in candidates:
+            _pinned = dict(pinned)
+            _pinned[family] = (version, name)
+            _constraints = dict(constraints)
+            _queue = list(queue[1:])
+
+            failure = self._constrain(name, _pinned, _constraints, _queue)
+            if failure:
+                logger.debug('Rejected %s: %s' % (name, failure[0]))
+                continue
+
+            try:
+                return self._search(_pinned, _constraints, tuple(_queue))
+            except errors.UnsatisfiableRequirementsError as e:
+                failure = (e.args[0], e.family, e.constraints)
+
+        self._failures[state] = failure
+        raise errors.UnsatisfiableRequirementsError(*failure)
+
+    def _sort(self, pinned, order):
+        names = []
+        for family in order:
+            if pinned[family][1] not in names:
+                names.append(pinned[family][1])
+        for family in sorted(pinned):
+            if pinned[family][1] not in names:
+                names.append(pinned[family][1])
+
+        edges = {}
+        for name in names:
+            edges[name] = []
+            for requirement in self._requires(name):
+                family = parse_requirement(requirement)[0]
+                if family in pinned:
+                    edges[name].append(pinned[family][1])
+
+        # Tools may require each other, which check_requirements accepts.
+        return graph.toposort(names, edges, label='tool', allow_cycles=True)
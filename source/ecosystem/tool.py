@@ -1,8 +1,158 @@
-import re
 import os
+import threading
+import collections
+
+from ecosystem import resolver
+
+try:
+    intern
+except NameError:
+    from sys import intern
+
+
+class _LRUCache(object):
+    '''A dict keeping only the ``size`` most recently used keys.'''
+
+    def __init__(self, size):
+        self.size = size
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is None:
+                return default
+            self._data[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+
+# Reference names found in each distinct value. Values repeat across the
+# versions of a tool, so most variables share their dependency tuple. It is
+# bounded for long-running watch and daemon processes, where every edited
+# value would otherwise stay forever.
+_dependencies = _LRUCache(100000)
+
+# Shared tuples of the path list options enabled on variables.
+_path_options = {}
+
+
+def supports_platform(platforms, platform):
+    return platform in platforms or not platforms or '*' in platforms
+
+
+def references(value):
+    '''Names referenced as ${VAR}, $VAR or %VAR% in value, upper case.'''
+    names = _dependencies.get(value)
+    if names is None:
+        names = []
+        for match in resolver.reference_regex.finditer(value):
+            name = intern(str(
+                match.group(1) or match.group(2) or match.group(3)
+            ).upper())
+            if name not in names:
+                names.append(name)
+
+        names = _dependencies[value] = tuple(names)
+    return names
+
+
+def remember_references(values):
+    '''Seed references() with names extracted ahead of time.'''
+    for value, names in values.items():
+        if value not in _dependencies:
+            _dependencies[value] = tuple(intern(str(x)) for x in names)
+
+
+def platform_value(value, platform):
+    '''The raw string a variable value holds on platform.'''
+    if isinstance(value, dict):
+        value = value.get(platform, '') or value.get('*', '')
+
+    if isinstance(value, (list, tuple, set)):
+        value = os.pathsep.join(value)
+
+    return value
+
+
+class ToolEntry(object):
+    '''Raw data of a single tool version, as recorded at discovery.
+
+    Versions defined together share the platforms, requires, environment and
+    optional objects, which are never modified.
+    '''
+
+    __slots__ = ('tool', 'version', 'platforms', 'requires', 'environment',
+                 'optional', 'source')
+
+    def __init__(
+            self, tool, version, platforms, requires, environment, optional,
+            source):
+        self.tool = tool
+        self.version = version
+        self.platforms = platforms
+        self.requires = requires
+        self.environment = environment
+        self.optional = optional
+        self.source = source
+
+    def __repr__(self):
+        return '<%s.%s "%s%s">' % (
+            __name__,
+            self.__class__.__name__,
+            self.tool, self.version
+        )
+
+    @property
+    def name(self):
+        return self.tool + self.version
+
+    def supports(self, platform):
+        return supports_platform(self.platforms, platform)
+
+    def check(self, platform):
+        '''Raise what building the tool for platform would raise while
+        formatting its values, without building it.'''
+        format_args = dict(
+            tool=self.tool, version=self.version, platform=platform)
+        values = list(self.environment.values())
+        for env in self.optional.values():
+            values.extend(env.values())
+
+        for value in values:
+            platform_value(value, platform) % format_args
+
+    def build(self, ecosystem, force_platform=None):
+        return Tool(
+            ecosystem=ecosystem,
+            tool=self.tool,
+            version=self.version,
+            platforms=self.platforms,
+            requires=self.requires,
+            environment=self.environment,
+            optional=self.optional,
+            source=self.source,
+            force_platform=force_platform
+        )
 
 
 class Tool(object):
+    __slots__ = ('tool', 'version', 'platforms', 'requires', 'platform',
+                 'source', 'valid', 'envs')
+
     def __init__(
             self, ecosystem, tool, version, platforms, requires, environment,
             optional, source, force_platform=None):
@@ -12,9 +162,7 @@ class Tool(object):
         self.requires = requires
         self.platform = force_platform
         self.source = source
-        self.valid = self.platform in self.platforms or \
-            not self.platforms or \
-            '*' in self.platforms
+        self.valid = supports_platform(self.platforms, self.platform)
 
         self.envs = []
         for key, value in environment.items():
@@ -32,7 +180,7 @@ class Tool(object):
                     Variable(
                         tool=self,
                         key=key,
-                        value=value,
+                        value=val,
                         requires=requirement
                     )
                 )
@@ -50,26 +198,21 @@ class Tool(object):
 
 
 class Variable(object):
-    dependency_regexes = [
-        re.compile(r"\${\w+}"),
-        re.compile(r"\$\w+"),
-        re.compile(r"%\w+%"),
-    ]
+    __slots__ = ('tool', 'key', 'value', 'requires', 'dependencies', '_mode',
+                 '_path_options')
 
     def __init__(self, tool, key, value, requires=None):
         self.tool = tool
-        self.key = key
-        self._raw_value = value
+        self.key = intern(str(key))
         self._mode = 'append'
+        self._path_options = ()
         if isinstance(value, dict):
-            value = self._raw_value.get(self.tool.platform, '')
-            value = value or self._raw_value.get('*', '')
-
-            self._mode = self._raw_value.get('mode', self._mode)
-
-        if isinstance(value, (list, tuple, set)):
-            value = os.pathsep.join(value)
+            self._mode = intern(str(value.get('mode', self._mode)))
+            options = tuple(
+                x for x in resolver.path_options if value.get(x))
+            self._path_options = _path_options.setdefault(options, options)
 
+        value = platform_value(value, self.tool.platform)
         self.value = self.format_value(value)
 
         self.requires = requires
@@ -85,6 +228,9 @@ class Variable(object):
     def mode(self):
         return self._mode
 
+    def path_options(self):
+        return self._path_options
+
     def format_value(self, value):
         format_args = dict(
             tool=self.tool.tool,
@@ -94,10 +240,4 @@ class Variable(object):
         return value % format_args
 
     def get_dependencies(self):
-        dependencies = []
-        for regex in self.dependency_regexes:
-            result = regex.findall(self.value)
-            if result:
-                dependencies += [x.strip('${}%') for x in result]
-        dependencies = list(set([x.upper() for x in dependencies]))
-        return dependencies
+        return references(self.value)
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import atexit
+import functools
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_tracer = None
+
+
+class Tracer(object):
+    '''Collects timed spans as Chrome trace events.'''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<%s.%s "%s">' % (
+            __name__,
+            self.__class__.__name__,
+            self.path
+        )
+
+    def add(self, name, category, start, end, args):
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.current_thread().ident,
+            'args': args,
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def write(self, path=None):
+        path = path or self.path
+        with self._lock:
+            events = list(self.events)
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def slowest(self, category='file', limit=10):
+        with self._lock:
+            events = [x for x in self.events if x['cat'] == category]
+
+        return sorted(events, key=lambda x: x['dur'], reverse=True)[:limit]
+
+    def summary(self, category='file', limit=10):
+        lines = ['%10s  %-16s %s' % ('ms', 'handler', 'file')]
+        for event in self.slowest(category=category, limit=limit):
+            lines.append('%10.2f  %-16s %s' % (
+                event['dur'] / 1000.0,
+                event['args'].get('handler', ''),
+                event['args'].get('path', event['name'])
+            ))
+
+        return '\n'.join(lines)
+
+
+class _Span(object):
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.tracer.add(
+            self.name, self.category, self.start, time.time(), self.args)
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+def span(name, category='ecosystem', **args):
+    if _tracer is None:
+        return _null_span
+
+    return _Span(_tracer, name, category, args)
+
+
+def traced(name, category='ecosystem'):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, category=category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_tracer():
+    return _tracer
+
+
+def enable(path=None):
+    '''Start tracing; the trace is written to ``path`` when Python exits.'''
+    global _tracer
+
+    if _tracer is None:
+        _tracer = Tracer(path)
+        if path:
+            atexit.register(_finish, _tracer)
+    elif path and not _tracer.path:
+        _tracer.path = path
+        atexit.register(_finish, _tracer)
+
+    return _tracer
+
+
+def disable():
+    global _tracer
+    _tracer = None
+
+
+def _finish(tracer):
+    try:
+        tracer.write()
+    except (IOError, OSError) as e:
+        logger.warn('Could not write trace "%s": %s' % (tracer.path, e))
+        return
+
+    logger.info('Trace written to "%s". Slowest files:\n%s' % (
+        tracer.path, tracer.summary()))
+
+
+if os.getenv('ECO_TRACE'):
+    enable(os.getenv('ECO_TRACE'))
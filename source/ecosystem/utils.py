@@ -1,10 +1,22 @@
 import os
+import sys
 import json
+import stat
+import errno
+import hashlib
+import tempfile
 import subprocess
 import logging
 
+from ecosystem import errors
+
 logger = logging.getLogger(__name__)
 
+_replace = getattr(os, 'replace', os.rename)
+
+# Snapshots are content-addressed, so a path always holds the same data.
+_snapshots = {}
+
 
 def retrieve_environment():
     environment = os.getenv('ECO_PREVIOUS_ENV')
@@ -12,26 +24,151 @@ def retrieve_environment():
     if not environment:
         return None
 
+    if environment in _snapshots:
+        return dict(_snapshots[environment])
+
     if not os.path.isfile(environment):
         raise ValueError('ECO_PREVIOUS_ENV does not point to a file')
 
+    # It becomes the environment of what is run: only trust a file no one
+    # else could have written.
+    check_private(os.path.dirname(os.path.abspath(environment)))
+    check_private(environment, directory=False)
+
     with open(environment, 'r') as f:
         data = json.load(f)
 
-    return {str(x): str(y) for x, y in data.items()}
+    from ecosystem import snapshots
+
+    data = {str(x): str(y) for x, y in data.items()}
+    if snapshots.SnapshotStore.prefix in os.path.basename(environment):
+        _snapshots[environment] = data
 
+    return dict(data)
 
-def call_process(command, detached=False, **kwargs):
+
+def call_process(command, detached=False, environment=None, **kwargs):
+    if environment is not None:
+        kwargs['env'] = environment.resolve_environ(
+            base=kwargs.get('env'), store_previous=True)
+        environment.commit_snapshot(kwargs['env'])
 
     kwargs.update({'args': command})
 
     if detached:
+        # Nobody reads pipes the caller did not ask for, a chatty child would
+        # block once their buffer fills. Output goes where ours goes.
         func = subprocess.Popen
-        kwargs['stdin'] = subprocess.PIPE
-        kwargs['stdout'] = subprocess.PIPE
-        kwargs['stderr'] = subprocess.PIPE
+        if 'stdin' not in kwargs:
+            kwargs['stdin'] = getattr(subprocess, 'DEVNULL', None) or \
+                open(os.devnull, 'rb')
 
     else:
         func = subprocess.call
 
     return func(**kwargs)
+
+
+def atomic_write(path, data, mode=None):
+    '''Write data, bytes or text, to path through a temporary file in the
+    same directory, so readers only ever see a complete file. The file gets
+    permission bits mode, or the private ones of mkstemp.'''
+    handle, temp_path = tempfile.mkstemp(
+        prefix='.%s.' % os.path.basename(path),
+        dir=os.path.dirname(os.path.abspath(path))
+    )
+    try:
+        with os.fdopen(handle, 'wb' if isinstance(data, bytes) else 'w') \
+                as f:
+            f.write(data)
+        if mode is not None:
+            os.chmod(temp_path, mode)
+        _replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def check_private(path, directory=True):
+    '''Raise UnsafePathError unless path is owned by the current user and
+    no one else can write to it, or swap it when it is a symlink.'''
+    if not hasattr(os, 'getuid'):
+        return
+
+    for path_stat in (os.lstat(path), os.stat(path)):
+        if path_stat.st_uid != os.getuid():
+            raise errors.UnsafePathError(
+                '"%s" is not owned by the current user' % path)
+
+    if directory != stat.S_ISDIR(path_stat.st_mode):
+        raise errors.UnsafePathError('"%s" is not a %s' % (
+            path, 'directory' if directory else 'file'))
+
+    if path_stat.st_mode & 0o022:
+        raise errors.UnsafePathError(
+            '"%s" is writable by other users' % path)
+
+
+def private_directory(path):
+    '''Create the directory path, only accessible to the current user, or
+    check that the existing one is private. Raises UnsafePathError.'''
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    check_private(path)
+    return path
+
+
+def module_name(path, prefix='module'):
+    '''A private module name for the file at path, unique per path so
+    that loading it never shadows an installed module.'''
+    digest = hashlib.sha1(
+        os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    return '_ecosystem_%s_%s' % (prefix, digest)
+
+
+def load_module(path, prefix='module'):
+    '''Import the Python file at path under a private name, see
+    module_name. The module is not left in sys.modules.'''
+    name = module_name(path, prefix)
+    if sys.version_info[0] == 2:
+        import imp
+        registered = name in sys.modules
+        try:
+            return imp.load_source(name, path)
+        finally:
+            if not registered:
+                sys.modules.pop(name, None)
+
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(name, path)
+    if spec is None or spec.loader is None:
+        raise ImportError('Cannot load "%s"' % path)
+
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def map_ordered(func, arguments, workers=None, executor='thread'):
+    arguments = list(arguments)
+    if not workers or workers < 2 or len(arguments) < 2:
+        return [func(*x) for x in arguments]
+
+    from concurrent import futures
+
+    if executor == 'process':
+        pool = futures.ProcessPoolExecutor(max_workers=workers)
+        chunksize = max(1, len(arguments) // (workers * 4))
+    elif executor == 'thread':
+        pool = futures.ThreadPoolExecutor(max_workers=workers)
+        chunksize = 1
+    else:
+        raise ValueError('Unsupported executor "%s"' % executor)
+
+    with pool:
+        return list(pool.map(func, *zip(*arguments), chunksize=chunksize))
@@ -0,0 +1,360 @@
+import re
+import bisect
+import functools
+
+version_regex = re.compile(
+    r'^v?(?P<release>\d+(?:\.\d+)*)'
+    r'(?:[._-]?(?P<pre>a|alpha|b|beta|c|rc|pre|preview)[._-]?(?P<pre_n>\d*))?'
+    r'(?:[._-]?(?P<post>post|rev|r|p)[._-]?(?P<post_n>\d*))?'
+    r'(?:[._-]?(?P<dev>dev)[._-]?(?P<dev_n>\d*))?$',
+    re.IGNORECASE
+)
+
+specifier_regex = re.compile(r'^\s*(~=|==|!=|<=|>=|<|>|=)?\s*(\S+?)\s*$')
+
+requirement_regex = re.compile(
+    r'^\s*([^\s<>=!~,]+?)\s*((?:~=|==|!=|<=|>=|<|>|=).*)$')
+
+_pre_phases = {
+    'a': 0, 'alpha': 0,
+    'b': 1, 'beta': 1,
+    'c': 2, 'rc': 2, 'pre': 2, 'preview': 2,
+}
+
+_specifiers = {}
+
+
+@functools.total_ordering
+class Version(object):
+    '''A tool version, ordered like PEP 440 versions.
+
+    "1.0.0rc14" < "1.0.0" < "1.0.0.post1", and "2016" == "2016.0". Versions
+    that do not follow that scheme sort before all others, part by part.
+    '''
+
+    def __init__(self, version):
+        self.string = str(version)
+        match = version_regex.match(self.string.strip())
+
+        if match is None:
+            self.release = ()
+            self.is_prerelease = False
+            self.key = (0, tuple(
+                (0, int(x), '') if x.isdigit() else (1, 0, x.lower())
+                for x in re.findall(r'\d+|[a-zA-Z]+', self.string)
+            ))
+            return
+
+        self.release = tuple(
+            int(x) for x in match.group('release').split('.'))
+        release = list(self.release)
+        while len(release) > 1 and release[-1] == 0:
+            release.pop()
+
+        pre = match.group('pre')
+        post = match.group('post')
+        dev = match.group('dev')
+
+        if pre:
+            pre_key = (
+                _pre_phases[pre.lower()], int(match.group('pre_n') or 0))
+        elif dev and not post:
+            # 1.0.dev1 comes before 1.0a1
+            pre_key = (-1, 0)
+        else:
+            pre_key = (3, 0)
+
+        post_key = int(match.group('post_n') or 0) if post else -1
+        dev_key = (0, int(match.group('dev_n') or 0)) if dev else (1, 0)
+
+        self.is_prerelease = bool(pre or dev)
+        self.key = (1, tuple(release), pre_key, post_key, dev_key)
+
+    def __repr__(self):
+        return '<%s.%s "%s">' % (
+            __name__,
+            self.__class__.__name__,
+            self.string
+        )
+
+    def __str__(self):
+        return self.string
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return self.key == _version(other).key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self.key < _version(other).key
+
+
+def _version(value):
+    return value if isinstance(value, Version) else Version(value)
+
+
+def _bump(release):
+    '''Smallest release after every release starting with ``release``.'''
+    return Version('.'.join(str(x) for x in release[:-1] + (release[-1] + 1,)))
+
+
+class Specifier(object):
+    def __init__(self, specifier):
+        match = specifier_regex.match(specifier)
+        if not match:
+            raise ValueError('Invalid version specifier "%s"' % specifier)
+
+        self.string = specifier.strip()
+        self.operator = match.group(1) or '=='
+        if self.operator == '=':
+            self.operator = '=='
+
+        version = match.group(2)
+        self.wildcard = version.endswith('.*')
+        if self.wildcard:
+            if self.operator not in ('==', '!='):
+                raise ValueError(
+                    'Wildcards are only supported with == and != in "%s"' %
+                    specifier)
+            version = version[:-2]
+
+        self.version = Version(version)
+        if self.operator == '~=' and len(self.version.release) < 2:
+            raise ValueError(
+                '~= needs at least two release numbers in "%s"' % specifier)
+
+    def __repr__(self):
+        return '<%s.%s "%s">' % (
+            __name__,
+            self.__class__.__name__,
+            self.string
+        )
+
+    def bounds(self):
+        '''(lowest, lowest included, highest, highest included) versions
+        that may match, None meaning unbounded.'''
+        version = self.version
+        if self.operator == '==' and self.wildcard:
+            lowest = Version('%s.dev0' % version)
+            return lowest, True, _bump(version.release), False
+        if self.operator == '==':
+            return version, True, version, True
+        if self.operator == '~=':
+            return version, True, _bump(version.release[:-1]), False
+        if self.operator == '>=':
+            return version, True, None, False
+        if self.operator == '>':
+            return version, False, None, False
+        if self.operator == '<=':
+            return None, False, version, True
+        if self.operator == '<':
+            return None, False, version, False
+        return None, False, None, False
+
+    def contains(self, version):
+        version = _version(version)
+        operator = self.operator
+
+        if self.wildcard:
+            prefix = self.version.release
+            matches = version.release[:len(prefix)] == prefix and \
+                version.key[0] == 1
+            return matches if operator == '==' else not matches
+
+        key = version.key
+        own = self.version.key
+        if operator == '==':
+            return key == own
+        if operator == '!=':
+            return key != own
+        if operator == '>=':
+            return key >= own
+        if operator == '<=':
+            return key <= own
+        if operator == '>':
+            return key > own
+        if operator == '<':
+            # <2018 does not match 2018rc1, unless asked for explicitly.
+            if key < own:
+                return self.version.is_prerelease or not (
+                    version.is_prerelease and key[1] == own[1])
+            return False
+        if operator == '~=':
+            prefix = self.version.release[:-1]
+            return key >= own and version.release[:len(prefix)] == prefix
+
+        return False
+
+
+class SpecifierSet(object):
+    '''Comma separated specifiers that must all match, e.g. ">=2016,<2018".
+
+    An empty string or "*" matches every version.
+    '''
+
+    def __init__(self, specifiers=''):
+        self.string = specifiers.strip()
+        self.specifiers = [
+            Specifier(x) for x in self.string.split(',')
+            if x.strip() and x.strip() != '*'
+        ]
+        self.prereleases = any(
+            x.version.is_prerelease for x in self.specifiers)
+        self._bounds = None
+
+    def __repr__(self):
+        return '<%s.%s "%s">' % (
+            __name__,
+            self.__class__.__name__,
+            self.string
+        )
+
+    def contains(self, version, prereleases=None):
+        version = _version(version)
+        if prereleases is None:
+            prereleases = self.prereleases
+
+        if version.is_prerelease and not prereleases:
+            return False
+
+        return all(x.contains(version) for x in self.specifiers)
+
+    def bounds(self):
+        if self._bounds is None:
+            self._bounds = self._get_bounds()
+        return self._bounds
+
+    def _get_bounds(self):
+        low, low_inclusive, high, high_inclusive = None, False, None, False
+        for specifier in self.specifiers:
+            s_low, s_low_inclusive, s_high, s_high_inclusive = \
+                specifier.bounds()
+
+            if s_low is not None and (
+                    low is None or s_low > low or
+                    (s_low == low and not s_low_inclusive)):
+                low, low_inclusive = s_low, s_low_inclusive
+
+            if s_high is not None and (
+                    high is None or s_high < high or
+                    (s_high == high and not s_high_inclusive)):
+                high, high_inclusive = s_high, s_high_inclusive
+
+        return low, low_inclusive, high, high_inclusive
+
+
+def get_specifier(specifiers):
+    '''Parsed SpecifierSet, memoized since the same ranges are queried over
+    and over.'''
+    if isinstance(specifiers, SpecifierSet):
+        return specifiers
+
+    specifier = _specifiers.get(specifiers)
+    if specifier is None:
+        specifier = _specifiers[specifiers] = SpecifierSet(specifiers or '')
+    return specifier
+
+
+def parse_requirement(requirement):
+    '''Split "maya>=2016,<2018" into ("maya", ">=2016,<2018"), or return
+    None when it is not a range requirement.'''
+    match = requirement_regex.match(requirement)
+    if not match:
+        return None
+    return match.group(1), match.group(2)
+
+
+class VersionIndex(object):
+    '''Versions of every tool family, sorted for range queries.'''
+
+    def __init__(self, entries=()):
+        self._families = {}
+        for entry in entries:
+            self.add(entry.tool, entry.version, entry.name)
+
+    def __repr__(self):
+        return '<%s.%s "%i tools">' % (
+            __name__,
+            self.__class__.__name__,
+            len(self._families)
+        )
+
+    def add(self, tool, version, name):
+        keys, items = self._families.setdefault(tool, ([], []))
+        version = Version(version)
+        index = bisect.bisect_right(keys, version.key)
+        keys.insert(index, version.key)
+        items.insert(index, (version, name))
+
+    def remove(self, tool, version, name):
+        keys, items = self._families.get(tool, ([], []))
+        key = Version(version).key
+        start = bisect.bisect_left(keys, key)
+        for index in range(start, bisect.bisect_right(keys, key)):
+            if items[index][1] == name:
+                del keys[index]
+                del items[index]
+                break
+
+        if not keys:
+            self._families.pop(tool, None)
+
+    def tools(self):
+        return sorted(self._families)
+
+    def _family(self, tool):
+        return self._families.get(tool, ([], []))
+
+    def _window(self, tool, specifier):
+        keys, items = self._family(tool)
+
+        low, low_inclusive, high, high_inclusive = specifier.bounds()
+        start, end = 0, len(keys)
+        if low is not None:
+            bisector = bisect.bisect_left if low_inclusive \
+                else bisect.bisect_right
+            start = bisector(keys, low.key)
+        if high is not None:
+            bisector = bisect.bisect_right if high_inclusive \
+                else bisect.bisect_left
+            end = bisector(keys, high.key)
+
+        return items[start:end]
+
+    def find(self, tool, specifiers=None, prereleases=None):
+        '''(Version, tool name) pairs matching ``specifiers``, oldest first.
+
+        Pre-releases only match when a specifier mentions one, or when
+        nothing else matches.
+        '''
+        specifier = get_specifier(specifiers)
+        candidates = self._window(tool, specifier)
+        found = [
+            x for x in candidates
+            if specifier.contains(x[0], prereleases=prereleases)
+        ]
+        if not found and prereleases is None:
+            found = [
+                x for x in candidates
+                if specifier.contains(x[0], prereleases=True)
+            ]
+
+        return found
+
+    def latest(self, tool, specifiers=None, prereleases=None):
+        specifier = get_specifier(specifiers)
+        candidates = self._window(tool, specifier)
+        for item in reversed(candidates):
+            if specifier.contains(item[0], prereleases=prereleases):
+                return item
+
+        if prereleases is None:
+            for item in reversed(candidates):
+                if specifier.contains(item[0], prereleases=True):
+                    return item
+
+        return None
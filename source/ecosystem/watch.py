@@ -0,0 +1,303 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import logging
+import threading
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# inotify(7)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE)
+
+_event = struct.Struct('iIII')
+
+# Filesystems where changes made by other hosts never reach inotify.
+REMOTE_FILESYSTEMS = (
+    'nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'afs', 'lustre', 'gpfs', 'ceph',
+    'glusterfs', 'fuse.glusterfs', 'fuse.sshfs', '9p'
+)
+
+
+def _mounts():
+    mounts = []
+    try:
+        with open('/proc/mounts', 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace('\\040', ' ')
+                mounts.append((mount_point, fields[2]))
+    except (IOError, OSError):
+        pass
+    return mounts
+
+
+def is_remote(path, mounts=None):
+    '''Whether ``path`` is on a network filesystem, as far as we can tell.'''
+    path = os.path.realpath(path)
+    fstype = None
+    longest = -1
+    for mount_point, mount_type in (_mounts() if mounts is None else mounts):
+        prefix = mount_point.rstrip('/') + '/'
+        if (path == mount_point or path.startswith(prefix)) and \
+                len(mount_point) > longest:
+            fstype = mount_type
+            longest = len(mount_point)
+
+    return fstype in REMOTE_FILESYSTEMS
+
+
+class _Inotify(object):
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        self._get_errno = ctypes.get_errno
+        self.directories = {}
+
+    def add(self, directory):
+        path = directory
+        if not isinstance(path, bytes):
+            path = path.encode(sys.getfilesystemencoding() or 'utf-8')
+
+        descriptor = self._libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if descriptor < 0:
+            error = self._get_errno()
+            raise OSError(error, os.strerror(error))
+
+        self.directories[descriptor] = directory
+
+    def read(self, timeout):
+        '''Return the changed paths, or None if events were lost.'''
+        ready = select.select([self.fd], [], [], timeout)[0]
+        if not ready:
+            return set()
+
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return set()
+            raise
+
+        changed = set()
+        offset = 0
+        while offset + _event.size <= len(data):
+            descriptor, mask, cookie, length = _event.unpack_from(
+                data, offset)
+            offset += _event.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                return None
+
+            directory = self.directories.get(descriptor)
+            if directory is None or not name:
+                continue
+
+            if not isinstance(directory, bytes):
+                name = name.decode(sys.getfilesystemencoding() or 'utf-8')
+            changed.add(os.path.join(directory, name))
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Poller(object):
+    def __init__(self):
+        self.directories = []
+        self._state = {}
+
+    def add(self, directory):
+        self.directories.append(directory)
+        self._state.update(self._scan(directory))
+
+    def _scan(self, directory):
+        state = {}
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return state
+
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            state[path] = (stat.st_mtime, stat.st_size, stat.st_ino)
+
+        return state
+
+    def read(self):
+        state = {}
+        for directory in self.directories:
+            state.update(self._scan(directory))
+
+        changed = set(state) ^ set(self._state)
+        changed.update(
+            x for x in state if x in self._state and state[x] != self._state[x]
+        )
+        self._state = state
+        return changed
+
+    def close(self):
+        pass
+
+
+class Watcher(object):
+    '''Calls ``callback(paths)`` from a thread when files in directories
+    are created, modified or removed.
+
+    Local directories are watched with inotify where available, others are
+    polled every ``interval`` seconds. Bursts of events are reported
+    together once they settle. ``paths`` is None when events were lost and
+    anything may have changed.
+    '''
+
+    def __init__(self, directories, callback, interval=1.0, backend=None,
+                 settle=0.2):
+        self.directories = []
+        for directory in directories:
+            if directory and directory not in self.directories:
+                self.directories.append(directory)
+
+        self.callback = callback
+        self.interval = interval
+        self.settle = settle
+        self.backend = backend or os.getenv('ECO_WATCH_BACKEND', 'auto')
+        if self.backend not in ('auto', 'inotify', 'poll'):
+            raise ValueError('Unsupported watch backend "%s"' % self.backend)
+
+        self._inotify = None
+        self._poller = None
+        self._polled = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return '<%s.%s "%s">' % (
+            __name__,
+            self.__class__.__name__,
+            os.pathsep.join(self.directories)
+        )
+
+    def _setup(self):
+        mounts = _mounts()
+        for directory in self.directories:
+            if self.backend != 'poll' and os.path.isdir(directory) and (
+                    self.backend == 'inotify' or
+                    not is_remote(directory, mounts)):
+                try:
+                    if self._inotify is None:
+                        self._inotify = _Inotify()
+                    self._inotify.add(directory)
+                    continue
+                except (OSError, AttributeError) as e:
+                    logger.debug('Cannot use inotify for "%s": %s' % (
+                        directory, e))
+
+            if self._poller is None:
+                self._poller = _Poller()
+            self._poller.add(directory)
+            logger.debug('Polling "%s"' % directory)
+
+        self._polled = time.time()
+
+    def _read(self, timeout):
+        changed = set()
+        if self._inotify is not None:
+            changed = self._inotify.read(timeout)
+        else:
+            self._stopped.wait(timeout)
+
+        if self._poller is not None and \
+                time.time() - self._polled >= self.interval:
+            self._polled = time.time()
+            polled = self._poller.read()
+            if changed is not None:
+                changed.update(polled)
+
+        return changed
+
+    def _run(self):
+        pending = set()
+        lost = False
+        while not self._stopped.is_set():
+            try:
+                changed = self._read(
+                    self.settle if pending or lost else self.interval)
+            except Exception as e:
+                logger.warn('Stopped watching for changes: %s' % e)
+                logger.debug(traceback.format_exc())
+                return
+
+            if changed is None:
+                lost = True
+                continue
+            if changed:
+                pending.update(changed)
+                continue
+            if not pending and not lost:
+                continue
+
+            try:
+                self.callback(None if lost else sorted(pending))
+            except Exception as e:
+                logger.warn('Watch callback failed: %s' % e)
+                logger.debug(traceback.format_exc())
+
+            pending = set()
+            lost = False
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._setup()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='ecosystem-watch')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stopped.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+        for backend in (self._inotify, self._poller):
+            if backend is not None:
+                backend.close()
+        self._inotify = None
+        self._poller = None